@@ -0,0 +1,330 @@
+"""
+로컬 오디오 노드.
+
+봇 프로세스 대신 FFmpeg 실행, 볼륨 적용, Opus 인코딩을 맡는 별도 프로세스입니다. (Lavalink 노드와 비슷한 역할)
+봇은 로컬 소켓으로 play/stop/pause/resume/volume/seek 명령을 보내고, 노드는 20ms Opus 패킷과
+track_start/track_end/track_exception/seeked 이벤트를 돌려줍니다. 음성 UDP 전송은 Discord 음성 세션을 가진 봇이 계속 맡습니다.
+
+메시지 형식: 헤더(종류 1바이트, 스트림 id 4바이트, 길이 4바이트) + 내용
+  CONTROL: JSON 명령/이벤트, AUDIO: Opus 패킷 1개
+흐름 제어: 스트림마다 CREDIT_WINDOW개 패킷까지 보낼 수 있고, 봇이 재생한 만큼 credit 명령으로 다시 허용합니다.
+
+사용 예:
+    python audio_node.py --listen unix:/tmp/musicbot-audio.sock
+    python audio_node.py --listen tcp:127.0.0.1:2333
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import threading
+
+import discord
+
+log = logging.getLogger("musicbot.audio_node")
+
+HEADER = struct.Struct("!BII")
+CONTROL = 1
+AUDIO = 2
+CREDIT_WINDOW = 100  # 봇의 허용 없이 미리 보낼 수 있는 패킷 수 (2초)
+CREDIT_BATCH = 25    # 봇이 이만큼 재생할 때마다 credit을 돌려줌
+FRAME_LENGTH = 0.02  # 오디오 프레임(Opus 패킷) 하나의 길이 (초)
+FFMPEG_BEFORE_OPTIONS = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+
+
+def ffmpeg_before_options(url, start=0.0):
+    """재연결 옵션은 HTTP 입력에만 적용 (봇의 오디오 캐시 파일은 로컬 경로로 전달됨), start초 위치부터 읽음"""
+    before_options = FFMPEG_BEFORE_OPTIONS if url.startswith(("http://", "https://")) else ""
+    if start:
+        before_options += f" -ss {start:.2f}"
+    return before_options.strip()
+
+
+def open_opus_audio(url, codec, volume, start=0.0):
+    """
+    Opus 패킷을 내는 FFmpeg 소스를 엽니다. (봇의 패스스루 재생과 노드가 함께 사용)
+    원본이 opus이고 볼륨이 100%면 패킷을 그대로 복사하고, 그 외에는 FFmpeg에서 volume 필터와 Opus 인코딩을 처리합니다.
+    """
+    before_options = ffmpeg_before_options(url, start)
+    if volume == 1.0 and codec == "opus":
+        return discord.FFmpegOpusAudio(url, codec="copy", before_options=before_options, options="-vn")
+    return discord.FFmpegOpusAudio(url, before_options=before_options, options=f"-vn -af volume={volume:.2f}")
+
+
+def pack(kind, stream_id, payload):
+    return HEADER.pack(kind, stream_id, len(payload)) + payload
+
+
+def pack_control(message, stream_id=0):
+    return pack(CONTROL, stream_id, json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+
+async def read_message(reader):
+    """(종류, 스트림 id, 내용)을 읽음. CONTROL 내용은 dict로 변환"""
+    kind, stream_id, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    payload = await reader.readexactly(length)
+    if kind == CONTROL:
+        payload = json.loads(payload)
+    return kind, stream_id, payload
+
+
+def parse_address(address):
+    """'unix:/path' 또는 'tcp:host:port'"""
+    scheme, _, rest = address.partition(":")
+    if scheme == "unix":
+        return "unix", rest
+    if scheme == "tcp":
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"알 수 없는 오디오 노드 주소: {address}")
+
+
+async def open_connection(address):
+    scheme, target = parse_address(address)
+    if scheme == "unix":
+        return await asyncio.open_unix_connection(target)
+    return await asyncio.open_connection(*target)
+
+
+class NodeStream:
+    """
+    노드에서 재생하는 스트림 하나.
+    읽기 스레드가 FFmpeg에서 Opus 패킷을 읽어 이벤트 루프로 넘기고, 받은 credit만큼만 읽습니다.
+    seek/볼륨 변경 시에는 FFmpeg를 다시 열고 generation을 올려, 이전 FFmpeg에서 읽은 패킷은 버립니다.
+    """
+    def __init__(self, connection, stream_id, url, codec, volume, start):
+        self.connection = connection
+        self.id = stream_id
+        self.url = url
+        self.codec = codec
+        self.volume = volume
+        self.start = start
+        self.sent = 0  # 현재 start 이후 보낸 패킷 수
+        self.credits = CREDIT_WINDOW
+        self.paused = False
+        self.stopped = False
+        self.generation = 0
+        self.source = None
+        self.cond = threading.Condition()
+
+    @property
+    def position(self):
+        return self.start + self.sent * FRAME_LENGTH
+
+    def _open(self, start):
+        return open_opus_audio(self.url, self.codec, self.volume, start)
+
+    def launch(self):
+        """현재 start 위치에서 FFmpeg와 읽기 스레드를 시작"""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            self.generation += 1
+            generation = self.generation
+            previous, self.source = self.source, None
+        if previous is not None:
+            previous.cleanup()
+        try:
+            source = self._open(self.start)
+        except Exception as e:
+            self.connection.stream_failed(self, e)
+            return
+        with self.cond:
+            self.source = source
+        threading.Thread(target=self._run, args=(loop, source, generation), daemon=True,
+                         name=f"audio-node-stream-{self.id}").start()
+
+    def _run(self, loop, source, generation):
+        while True:
+            with self.cond:
+                while (self.credits <= 0 or self.paused) and not self.stopped and generation == self.generation:
+                    self.cond.wait()
+                if self.stopped or generation != self.generation:
+                    return
+                self.credits -= 1
+            try:
+                data = source.read()
+            except Exception as e:
+                loop.call_soon_threadsafe(self.connection.stream_failed, self, e, generation)
+                return
+            if not data:
+                loop.call_soon_threadsafe(self.connection.stream_finished, self, generation)
+                return
+            loop.call_soon_threadsafe(self._deliver, data, generation)
+
+    def _deliver(self, data, generation):
+        if generation != self.generation or self.stopped:
+            with self.cond:
+                self.credits += 1  # 버린 패킷의 credit 반환
+                self.cond.notify()
+            return
+        self.sent += 1
+        self.connection.send_audio(self.id, data)
+
+    def grant(self, frames):
+        with self.cond:
+            self.credits += frames
+            self.cond.notify()
+
+    def set_paused(self, paused):
+        with self.cond:
+            self.paused = paused
+            self.cond.notify()
+
+    def restart(self, position, *, reset_credits):
+        """position부터 FFmpeg를 다시 열어 이어서 재생"""
+        with self.cond:
+            self.start = position
+            self.sent = 0
+            if reset_credits:
+                self.credits = CREDIT_WINDOW
+        self.launch()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+            source, self.source = self.source, None
+        if source is not None:
+            source.cleanup()
+
+
+class NodeConnection:
+    """봇 연결 하나. 연결이 끊기면 그 연결이 만든 스트림을 모두 정리"""
+    def __init__(self, node, reader, writer):
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.streams = {}
+
+    def send(self, message, stream_id=0):
+        if not self.writer.is_closing():
+            self.writer.write(pack_control(message, stream_id))
+
+    def send_audio(self, stream_id, data):
+        if not self.writer.is_closing():
+            self.writer.write(pack(AUDIO, stream_id, data))
+
+    def event(self, stream, type, **fields):
+        self.send(dict(op="event", type=type, id=stream.id, position=round(stream.position, 3), **fields), stream.id)
+
+    def stream_finished(self, stream, generation):
+        if generation != stream.generation or stream.stopped:
+            return
+        self.streams.pop(stream.id, None)
+        stream.stop()
+        self.event(stream, "track_end", reason="finished")
+
+    def stream_failed(self, stream, error, generation=None):
+        if generation is not None and generation != stream.generation:
+            return
+        log.warning("스트림 %d 재생 오류: %s", stream.id, error)
+        self.streams.pop(stream.id, None)
+        stream.stop()
+        self.event(stream, "track_exception", error=str(error))
+        self.event(stream, "track_end", reason="error")
+
+    def handle(self, message):
+        op = message.get("op")
+        stream = self.streams.get(message.get("id"))
+        if op == "play":
+            if stream is not None:
+                stream.stop()
+            stream = NodeStream(self, message["id"], message["url"], message.get("codec"),
+                                float(message.get("volume", 1.0)), float(message.get("start", 0.0)))
+            self.streams[stream.id] = stream
+            stream.launch()
+            if stream.id in self.streams:
+                self.event(stream, "track_start", guild=message.get("guild"))
+        elif op == "credit":
+            if stream is not None:
+                stream.grant(int(message["frames"]))
+        elif op == "stop":
+            if stream is not None:
+                self.streams.pop(stream.id, None)
+                stream.stop()
+                self.event(stream, "track_end", reason="stopped")
+        elif op in ("pause", "resume"):
+            if stream is not None:
+                stream.set_paused(op == "pause")
+        elif op == "volume":
+            if stream is not None and float(message["value"]) != stream.volume:
+                stream.volume = max(float(message["value"]), 0.0)
+                stream.restart(stream.position, reset_credits=False)
+        elif op == "seek":
+            if stream is not None:
+                stream.restart(max(float(message["position"]), 0.0), reset_credits=True)
+                self.event(stream, "seeked")
+        elif op == "stats":
+            self.send({"op": "stats", **self.node.stats()})
+        else:
+            log.warning("알 수 없는 명령: %s", message)
+
+    async def serve(self):
+        self.send({"op": "ready", "pid": os.getpid(), "credit_window": CREDIT_WINDOW, "credit_batch": CREDIT_BATCH})
+        try:
+            while True:
+                kind, _, message = await read_message(self.reader)
+                if kind == CONTROL:
+                    self.handle(message)
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for stream in self.streams.values():
+                stream.stop()
+            self.streams.clear()
+            self.writer.close()
+
+
+class AudioNode:
+    def __init__(self):
+        self.connections = set()
+
+    def stats(self):
+        streams = [stream for connection in self.connections for stream in connection.streams.values()]
+        return {
+            "connections": len(self.connections),
+            "streams": len(streams),
+            "paused": sum(1 for stream in streams if stream.paused),
+        }
+
+    async def handle_connection(self, reader, writer):
+        connection = NodeConnection(self, reader, writer)
+        self.connections.add(connection)
+        log.info("봇 연결됨 (연결 %d개)", len(self.connections))
+        try:
+            await connection.serve()
+        finally:
+            self.connections.discard(connection)
+            log.info("봇 연결 끊김 (연결 %d개)", len(self.connections))
+
+    async def serve(self, address):
+        scheme, target = parse_address(address)
+        if scheme == "unix":
+            if os.path.exists(target):
+                os.unlink(target)
+            server = await asyncio.start_unix_server(self.handle_connection, target)
+        else:
+            server = await asyncio.start_server(self.handle_connection, *target)
+        log.info("오디오 노드 대기 중: %s", address)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="music_bot_v4 오디오 노드")
+    parser.add_argument("--listen", default=os.getenv("audio_node", "unix:/tmp/musicbot-audio.sock"),
+                        help="unix:/경로 또는 tcp:호스트:포트")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("log_level", "INFO").upper(),
+                        format="%(asctime)s %(levelname)-8s %(name)s: %(message)s")
+    try:
+        asyncio.run(AudioNode().serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+music_bot_v4 재생 파이프라인 오프라인 벤치마크.
+
+Discord 연결과 YouTube 없이 Music 코그의 실제 로직(play, run_player, prefetch_related, from_mix_url)을
+가짜 음성 클라이언트와 지연 시간을 조절할 수 있는 yt-dlp 스텁으로 실행하고,
+대기열 추가 지연, 첫 소리까지 걸린 시간, 곡 전환 간격, 자동재생 보충 지연을 JSON으로 출력합니다.
+
+사용 예:
+    python bench_playback.py --guilds 4 --enqueue 5 --autoplay 3 --output before.json
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from urllib.parse import urlparse, parse_qs
+
+# 벤치마크마다 빈 캐시/저널에서 시작하고, 스텁 추출기와 가짜 PCM 소스를 쓰도록 .env 설정과 무관하게 재생 경로를 고정
+# (load_dotenv는 이미 있는 환경 변수를 덮어쓰지 않음)
+_workdir = tempfile.mkdtemp(prefix="bench_playback_")
+atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+os.environ["extraction_cache_path"] = os.path.join(_workdir, "extraction_cache.sqlite3")
+os.environ["queue_journal_path"] = os.path.join(_workdir, "queue_journal.jsonl")
+os.environ["extraction_backend"] = "thread"
+os.environ["audio_passthrough"] = "off"
+os.environ["audio_node"] = ""
+os.environ["audio_cache_dir"] = ""
+os.environ["metrics_port"] = "0"
+
+import discord
+import yt_dlp
+
+import music_bot_v4 as bot_module
+
+FRAME_BYTES = 3840  # 20ms 48kHz 16bit 스테레오 PCM
+
+
+class Latency:
+    """스텁 지연 시간 설정 (초)"""
+    def __init__(self, args):
+        self.extract = args.extract_latency
+        self.flat_page = args.flat_page_latency
+        self.jitter = args.jitter
+        self.ffmpeg_startup = args.ffmpeg_startup
+        self.frame_interval = args.frame_interval
+        self.duration = args.track_duration
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+LATENCY = None
+
+
+class StubYoutubeDL:
+    """
+    yt_dlp.YoutubeDL 대역. URL 형태에 따라 단일 영상, 플레이리스트(flat, process=False), 믹스 구간을 흉내 냅니다.
+    영상 id는 URL에서 그대로 가져오므로 매번 다른 id를 쓰면 추출 캐시가 적중하지 않습니다.
+    """
+    PAGE_SIZE = 100
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url, download=False, process=True):
+        query = parse_qs(urlparse(url).query)
+        playlist_id = query.get("list", [None])[0]
+        if playlist_id and playlist_id.startswith("RD"):
+            return self._mix(playlist_id[2:])
+        if playlist_id:
+            return self._playlist(playlist_id, int(query.get("size", ["50"])[0]))
+        LATENCY.sleep(LATENCY.extract)
+        return self._video(query.get("v", [url.rsplit("/", 1)[-1]])[0])
+
+    def _video(self, video_id):
+        expire = int(time.time()) + 6 * 3600
+        return {
+            "id": video_id,
+            "title": f"stub {video_id}",
+            "duration": LATENCY.duration,
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "thumbnail": "https://i.imgur.com/Tt6jwFk.png",
+            "url": f"https://stub.invalid/audio?id={video_id}&dur={LATENCY.duration}&expire={expire}",
+            "acodec": "opus",
+            "related_videos": [{}],
+        }
+
+    def _mix(self, seed):
+        LATENCY.sleep(LATENCY.extract)
+        start = self.params.get("playliststart") or 1
+        end = self.params.get("playlistend") or start + 24
+        return {"_type": "playlist", "entries": [
+            {"id": f"{seed}-mix{index}", "title": f"mix {seed} #{index}",
+             "url": f"https://www.youtube.com/watch?v={seed}-mix{index}"}
+            for index in range(start, min(end, 200) + 1)
+        ]}
+
+    def _playlist(self, playlist_id, size):
+        LATENCY.sleep(LATENCY.flat_page)
+
+        def entries():
+            for index in range(size):
+                if index and index % self.PAGE_SIZE == 0:
+                    LATENCY.sleep(LATENCY.flat_page)  # 다음 페이지 요청
+                yield {"id": f"{playlist_id}-{index}", "title": f"playlist {playlist_id} #{index}",
+                       "url": f"https://www.youtube.com/watch?v={playlist_id}-{index}",
+                       "ie_key": "Youtube", "duration": LATENCY.duration}
+        return {"_type": "playlist", "id": playlist_id, "entries": entries()}
+
+
+class FakeFFmpegAudio(discord.AudioSource):
+    """discord.FFmpegPCMAudio 대역. 첫 read에서 FFmpeg 실행/연결/프로브 지연을 흉내 내고 곡 길이만큼 무음 프레임을 냄"""
+    opened = 0
+
+    def __init__(self, url, **kwargs):
+        self.frames = int(float(parse_qs(urlparse(url).query)["dur"][0]) / bot_module.FRAME_LENGTH)
+        self.started = False
+        self.closed = False
+        FakeFFmpegAudio.opened += 1
+
+    def read(self):
+        if not self.started:
+            self.started = True
+            LATENCY.sleep(LATENCY.ffmpeg_startup)
+        if self.frames <= 0:
+            return b""
+        self.frames -= 1
+        return b"\0" * FRAME_BYTES
+
+    def cleanup(self):
+        if not self.closed:
+            self.closed = True
+            FakeFFmpegAudio.opened -= 1
+
+
+class FakeVoiceClient:
+    """
+    discord.VoiceClient 대역. play()는 별도 스레드에서 frame_interval마다 소스를 읽고,
+    끝나면 discord.py처럼 그 스레드에서 after 콜백을 호출합니다.
+    """
+    def __init__(self, guild, channel, recorder):
+        self.guild = guild
+        self.channel = channel
+        self.recorder = recorder
+        self._source = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._paused = False
+        self.connected = True
+
+    @property
+    def source(self):
+        return self._source
+
+    @source.setter
+    def source(self, value):
+        self._source = value
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive() and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def play(self, source, *, after=None):
+        self._source = source
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(source, after, self._stopped), daemon=True)
+        self._thread.start()
+
+    def _run(self, source, after, stopped):
+        first = True
+        while not stopped.is_set():
+            if self._paused:
+                time.sleep(LATENCY.frame_interval)
+                continue
+            data = source.read()
+            if not data:
+                break
+            if first:
+                first = False
+                self.recorder.first_frame(self.guild.id)
+            time.sleep(LATENCY.frame_interval)
+        self.recorder.last_frame(self.guild.id)
+        source.cleanup()
+        if after is not None:
+            after(None)
+
+    def stop(self):
+        self._stopped.set()
+
+    async def disconnect(self, *, force=False):
+        self.connected = False
+        self.stop()
+        self.guild.voice_client = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+
+class FakeMessage:
+    async def edit(self, **kwargs):
+        pass
+
+    async def delete(self):
+        pass
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def send_message(self, *args, **kwargs):
+        self.done = True
+
+    async def defer(self, *args, **kwargs):
+        self.done = True
+
+
+class FakeFollowup:
+    async def send(self, *args, **kwargs):
+        return FakeMessage()
+
+
+class FakeChannel:
+    def __init__(self, name):
+        self.name = name
+        self.members = [types.SimpleNamespace(bot=False)]
+
+    async def send(self, *args, **kwargs):
+        return FakeMessage()
+
+
+def make_interaction(guild, channel):
+    async def delete_original_response():
+        pass
+    return types.SimpleNamespace(
+        guild=guild,
+        guild_id=guild.id,
+        channel=channel,
+        user=types.SimpleNamespace(voice=types.SimpleNamespace(channel=guild.voice_channel)),
+        response=FakeResponse(),
+        followup=FakeFollowup(),
+        delete_original_response=delete_original_response,
+    )
+
+
+class Recorder:
+    """음성 스레드에서 올라오는 프레임 시각으로 첫 소리까지 걸린 시간과 곡 사이 무음 구간을 측정"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requested_at = {}
+        self.ended_at = {}
+        self.started = {}
+        self.first_audio = {}
+        self.gaps = []
+
+    def request(self, guild_id, kind):
+        self.requested_at[guild_id] = (time.perf_counter(), kind)
+
+    def first_frame(self, guild_id):
+        now = time.perf_counter()
+        with self.lock:
+            self.started[guild_id] = self.started.get(guild_id, 0) + 1
+            if guild_id not in self.first_audio and guild_id in self.requested_at:
+                requested_at, kind = self.requested_at[guild_id]
+                self.first_audio[guild_id] = (now - requested_at, kind)
+            ended_at = self.ended_at.pop(guild_id, None)
+            if ended_at is not None:
+                self.gaps.append(now - ended_at)
+
+    def last_frame(self, guild_id):
+        with self.lock:
+            self.ended_at[guild_id] = time.perf_counter()
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+    def percentile(p):
+        return samples[min(int(p * len(samples)), len(samples) - 1)]
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(0.5) * 1000, 3),
+        "p95_ms": round(percentile(0.95) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+async def run_guild(cog, recorder, guild_id, args, enqueue_latencies, kind):
+    channel = FakeChannel(f"voice-{guild_id}")
+    guild = types.SimpleNamespace(id=guild_id, voice_client=None, voice_channel=channel)
+    guild.voice_client = FakeVoiceClient(guild, channel, recorder)
+    cog.bot.voice_clients.append(guild.voice_client)
+    text_channel = FakeChannel(f"text-{guild_id}")
+
+    recorder.request(guild_id, kind)
+    if kind == "playlist":
+        url = f"https://www.youtube.com/playlist?list=PLbench{guild_id}&size={args.playlist_size}"
+    else:
+        url = f"https://www.youtube.com/watch?v=g{guild_id}-first"
+    await bot_module.Music.play.callback(cog, make_interaction(guild, text_channel), url)
+
+    for index in range(args.enqueue):
+        started = time.perf_counter()
+        await bot_module.Music.play.callback(cog, make_interaction(guild, text_channel),
+                                             f"https://www.youtube.com/watch?v=g{guild_id}-q{index}")
+        enqueue_latencies.append(time.perf_counter() - started)
+
+    # 플레이리스트 길드는 대기열이 남아 있으므로 재생 곡 수로만 종료
+    target = 1 + args.enqueue + args.autoplay
+    deadline = time.perf_counter() + args.timeout
+    while recorder.started.get(guild_id, 0) < target and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    # 마지막 곡의 전환 간격까지 측정한 뒤 정리
+    await cog.shutdown_player(guild, "벤치마크 종료")
+
+
+async def run(args):
+    recorder = Recorder()
+    loop = asyncio.get_running_loop()
+    cog = bot_module.Music(types.SimpleNamespace(loop=loop, voice_clients=[], get_guild=lambda guild_id: None))
+
+    mix_latencies = []
+    from_mix_url = bot_module.YTDLSource.from_mix_url.__func__
+
+    async def timed_from_mix_url(cls, *a, **kw):
+        started = time.perf_counter()
+        try:
+            return await from_mix_url(cls, *a, **kw)
+        finally:
+            mix_latencies.append(time.perf_counter() - started)
+    bot_module.YTDLSource.from_mix_url = classmethod(timed_from_mix_url)
+
+    enqueue_latencies = []
+    started = time.perf_counter()
+    jobs = [run_guild(cog, recorder, 1000 + index, args, enqueue_latencies, "video") for index in range(args.guilds)]
+    jobs += [run_guild(cog, recorder, 2000 + index, args, enqueue_latencies, "playlist") for index in range(args.playlist_guilds)]
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+    await asyncio.sleep(0.1)  # 정리 콜백 대기
+
+    first_audio = {"video": [], "playlist": []}
+    for latency, kind in recorder.first_audio.values():
+        first_audio[kind].append(latency)
+    return {
+        "enqueue_latency": summarize(enqueue_latencies),
+        "time_to_first_audio": summarize(first_audio["video"]),
+        "playlist_time_to_first_audio": summarize(first_audio["playlist"]),
+        "inter_track_gap": summarize(recorder.gaps),
+        "inter_track_prewarmed_ratio": cog.transition_stats()["prewarmed_ratio"],
+        "autoplay_refill_latency": summarize(mix_latencies),
+        "tracks_started": sum(recorder.started.values()),
+        "transition": cog.transition_stats(),
+        "extraction": bot_module.extraction_scheduler.stats(),
+        "extraction_cache": {"hits": bot_module.extraction_cache.hits, "misses": bot_module.extraction_cache.misses},
+        "ui": cog.ui_update_stats(),
+        "leaked_ffmpeg_sources": FakeFFmpegAudio.opened,
+        "elapsed_s": round(elapsed, 3),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description="music_bot_v4 재생 파이프라인 오프라인 벤치마크")
+    parser.add_argument("--guilds", type=int, default=4, help="단일 곡으로 시작하는 길드 수")
+    parser.add_argument("--playlist-guilds", type=int, default=1, help="플레이리스트로 시작하는 길드 수")
+    parser.add_argument("--playlist-size", type=int, default=150)
+    parser.add_argument("--enqueue", type=int, default=5, help="재생 중에 추가로 넣는 곡 수 (길드당)")
+    parser.add_argument("--autoplay", type=int, default=3, help="대기열이 빈 뒤 자동재생으로 재생할 곡 수 (길드당)")
+    parser.add_argument("--extract-latency", type=float, default=0.3, help="전체 추출 1회 지연 (초)")
+    parser.add_argument("--flat-page-latency", type=float, default=0.2, help="flat 플레이리스트 페이지당 지연 (초)")
+    parser.add_argument("--ffmpeg-startup", type=float, default=0.15, help="FFmpeg 실행~첫 프레임 지연 (초)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="지연 시간 무작위 변동 비율")
+    parser.add_argument("--track-duration", type=int, default=6, help="스텁 곡 길이 (초, 재생 시간 기준)")
+    # 봇의 사전 준비(prewarm_next)는 남은 재생 시간을 실제 시간으로 기다리므로, 실시간보다 빠르게 재생하면
+    # 사전 준비가 끝나기 전에 곡이 끝나 곡 전환 간격이 사전 준비 경로를 측정하지 못함
+    parser.add_argument("--frame-interval", type=float, default=bot_module.FRAME_LENGTH,
+                        help="가짜 음성 클라이언트의 프레임 간격 (초, 기본값은 실시간 20ms)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="결과 JSON 파일 경로 (기본: 표준 출력)")
+    parser.add_argument("--verbose", action="store_true", help="봇의 디버그 로그와 명령어 trace를 표준 에러로 출력")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    LATENCY = Latency(args)
+    yt_dlp.YoutubeDL = StubYoutubeDL
+    discord.FFmpegPCMAudio = FakeFFmpegAudio
+
+    if args.verbose:
+        bot_module.setup_logging()
+        bot_module.log.setLevel(logging.DEBUG)
+    else:
+        logging.disable(logging.WARNING)
+    results = asyncio.run(run(args))
+    report = {
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -63,7 +63,6 @@ class YTDLSource(discord.PCMVolumeTransformer):
 
         try:
             data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-            print(data)
         except Exception as e:
             print(f"❌ YTDL 에러 발생: {e}")  # 오류 출력
             return []
@@ -6,16 +6,131 @@ import os
 from dotenv import load_dotenv
 import yt_dlp as youtube_dl
 import datetime
+import itertools
+import json
+import logging
+import contextvars
+import functools
+import sqlite3
+import threading
+import time
+import multiprocessing
+import queue
+import random
+import re
+import sys
+import weakref
+from aiohttp import web
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import urlparse, parse_qs
+from audio_node import (AUDIO, CONTROL, CREDIT_BATCH, FRAME_LENGTH, ffmpeg_before_options, open_connection,
+                        open_opus_audio, pack_control, read_message)
 
 load_dotenv()
 
+log = logging.getLogger("musicbot")
+trace_log = logging.getLogger("musicbot.trace")  # 명령어별 단계 소요 시간
+LOG_LEVEL = os.getenv("log_level", "INFO").upper()
+LOG_FORMAT = os.getenv("log_format", "text").lower()  # text 또는 json
+
+# 샤딩/클러스터: cluster_count개 프로세스가 shard_count개 샤드를 나눠 맡고,
+# 각 프로세스는 자기 샤드에 속한 길드의 상태(대기열, 음성 연결, 저널)만 보유
+SHARD_COUNT = int(os.getenv("shard_count", "0")) or None  # None이면 Discord 권장 샤드 수
+CLUSTER_COUNT = max(int(os.getenv("cluster_count", "1")), 1)
+CLUSTER_ID = int(os.getenv("cluster_id", "0"))  # 클러스터 런처가 워커 프로세스마다 지정
+CLUSTER_START_DELAY = 5.0  # 샤드 하나가 IDENTIFY하는 데 필요한 간격 (초), 클러스터 시작을 이만큼씩 늦춤
+
+class JsonLogFormatter(logging.Formatter):
+    """로그 한 줄을 JSON 객체로 출력 (trace span은 span 필드에 포함)"""
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        span = getattr(record, "span", None)
+        if span is not None:
+            entry["span"] = span
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if CLUSTER_COUNT > 1:
+            entry["cluster"] = CLUSTER_ID
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        cluster = f" [cluster {CLUSTER_ID}]" if CLUSTER_COUNT > 1 else ""
+        handler.setFormatter(logging.Formatter(f"%(asctime)s %(levelname)-8s{cluster} %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    log.setLevel(LOG_LEVEL)
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class TraceSpan:
+    """명령어 하나의 전체 소요 시간과 단계(추출, 대기열, 음성 연결, UI 갱신 등)별 소요 시간"""
+    __slots__ = ("command", "guild_id", "started", "stages", "finished")
+
+    def __init__(self, command, guild_id):
+        self.command = command
+        self.guild_id = guild_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.finished = False
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def finish(self):
+        self.finished = True
+        if not trace_log.isEnabledFor(logging.INFO):
+            return
+        total = time.perf_counter() - self.started
+        stages = {stage: round(seconds * 1000, 1) for stage, seconds in self.stages.items()}
+        trace_log.info("command=%s guild=%s total_ms=%.1f %s", self.command, self.guild_id, total * 1000,
+                       " ".join(f"{stage}_ms={ms}" for stage, ms in stages.items()),
+                       extra={"span": {"command": self.command, "guild": self.guild_id,
+                                       "total_ms": round(total * 1000, 1), "stages": stages}})
+
+@contextmanager
+def trace_stage(stage):
+    """현재 명령어 span에 stage 소요 시간을 더함 (span 밖이나 명령어가 끝난 뒤의 백그라운드 작업에서는 무시)"""
+    span = current_span.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if span is not None and not span.finished:
+            span.add(stage, time.perf_counter() - started)
+
+def traced(command):
+    """슬래시 명령어 콜백을 trace span으로 감쌈"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, interaction, *args, **kwargs):
+            span = TraceSpan(command, interaction.guild_id)
+            token = current_span.set(span)
+            try:
+                return await func(self, interaction, *args, **kwargs)
+            finally:
+                current_span.reset(token)
+                span.finish()
+        return wrapper
+    return decorator
+
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix="/", description="봇 사용설명서", intents=intents)
-
 # YTDL 관련 설정
-youtube_dl.utils.bug_reports_message = lambda: ''
+youtube_dl.utils.bug_reports_message = lambda *args, **kwargs: ''
 
 ytdl_format_options = {
     'format': 'bestaudio/best',
@@ -34,132 +149,2091 @@ ytdl_format_options = {
     'force_generic_extractor': False,
 }
 
+# before_options(재연결, 시작 위치)는 입력에 따라 audio_node.ffmpeg_before_options로 만듦
 ffmpeg_options = {
-    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
     'options': '-vn',
 }
 
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+# 플레이리스트 점진 추가용: 항목을 전체 추출하지 않고 메타데이터만 가져옴
+ytdl_flat_options = ytdl_format_options.copy()
+ytdl_flat_options['extract_flat'] = 'in_playlist'
+
+# 자동재생 믹스 조회용: 항목 범위(playliststart/playlistend)는 조회할 때마다 지정
+ytdl_mix_options = ytdl_format_options.copy()
+ytdl_mix_options['extract_flat'] = True
+
+PLAYLIST_CHUNK_SIZE = 25  # 백그라운드에서 한 번에 대기열에 추가하는 항목 수
+UNAVAILABLE_TITLES = ("[Private video]", "[Deleted video]")
+
+# 추출 캐시 설정
+EXTRACTION_CACHE_PATH = os.getenv("extraction_cache_path", "extraction_cache.sqlite3")
+EXTRACTION_CACHE_SIZE = int(os.getenv("extraction_cache_size", "2048"))  # 메모리 LRU 항목 수
+EXTRACTION_CACHE_MAX_AGE = 30 * 24 * 3600  # 디스크에 보관하는 최대 기간 (초)
+DEFAULT_STREAM_TTL = 1800   # expire 파라미터가 없는 스트림 URL의 유효 시간 (초)
+# 검색어 캐시: 같은 검색어는 YouTube 검색 없이 이전 검색 결과의 video id로 바로 추출
+SEARCH_CACHE_SIZE = int(os.getenv("search_cache_size", "4096"))   # 보관하는 검색어 수
+SEARCH_CACHE_TTL = int(os.getenv("search_cache_ttl", "21600"))    # 검색 결과 보관 시간 (초)
+# 오디오 파일 캐시: audio_cache_dir를 지정하면 audio_cache_min_plays번 이상 재생된 곡을 내려받아 로컬 파일로 재생
+AUDIO_CACHE_DIR = os.getenv("audio_cache_dir")
+AUDIO_CACHE_SIZE = int(os.getenv("audio_cache_size", "2048")) * 1024 * 1024  # 최대 전체 크기 (MB 단위로 지정)
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv("audio_cache_min_plays", "3"))
+AUDIO_CACHE_MAX_DURATION = 1800  # 이보다 긴 곡(초)은 내려받지 않음
+AUDIO_CACHE_DOWNLOADS = 2        # 동시에 내려받는 곡 수
+AUDIO_CACHE_DOWNLOAD_TIMEOUT = 600  # 내려받는 중 표시가 이보다 오래되면 중단된 것으로 보고 다시 내려받음 (초)
+AUDIO_CACHE_PLAYS_MAX_AGE = 30 * 24 * 3600  # 캐시되지 않은 곡의 재생 횟수 기록 보관 기간 (초)
+# 대기열 저널 (재시작 후 대기열 복원)
+# 클러스터 모드에서는 프로세스마다 자기 길드의 저널 파일을 따로 씀
+QUEUE_JOURNAL_PATH = os.getenv("queue_journal_path", "queue_journal.jsonl")
+if CLUSTER_COUNT > 1:
+    QUEUE_JOURNAL_PATH = f"{os.path.splitext(QUEUE_JOURNAL_PATH)[0]}-{CLUSTER_ID}.jsonl"
+QUEUE_JOURNAL_INTERVAL = 5.0  # 변경된 길드 대기열을 모아서 기록하는 주기 (초)
+QUEUE_JOURNAL_COMPACT_BYTES = 16 * 1024 * 1024  # 파일이 이 크기(와 마지막 정리 직후 크기의 2배)를 넘으면 최신 스냅샷만 남기고 다시 씀
+EXTRACTION_WORKERS = int(os.getenv("extraction_workers", "4"))  # yt-dlp 추출 전용 워커 수
+EXTRACTION_BACKEND = os.getenv("extraction_backend", "thread").lower()  # thread 또는 process (GIL 회피)
+
+# 추출 작업 우선순위 (숫자가 작을수록 먼저 처리)
+PRIORITY_USER = 0      # 사용자가 직접 요청한 추출 (/pplay, 재생 직전 resolve)
+PRIORITY_AUTOPLAY = 1  # 재생이 멈춰 있는 자동재생 직접 추출
+PRIORITY_PREFETCH = 2  # prefetch, URL 사전 갱신, 플레이리스트 후속 항목
+
+# 길드 재생 작업이 처리하는 이벤트
+TRACK_END = "track_end"  # 재생 중이던 곡이 끝남 (voice 스레드의 after 콜백)
+ENQUEUE = "enqueue"      # 대기열에 곡이 추가됨
+SKIP = "skip"            # 현재 곡 건너뛰기
+# 길드 재생 상태
+STATE_IDLE = "idle"        # 재생 중인 곡 없음
+STATE_PLAYING = "playing"  # 곡 재생 중 (일시정지 포함)
+MAX_START_FAILURES = 3     # 재생 시작(소스 생성/play)이 연달아 이만큼 실패하면 (FFmpeg 없음 등) 더 시도하지 않고 IDLE로 둠
+
+AUDIO_PASSTHROUGH = os.getenv("audio_passthrough", "off").lower() in ("1", "on", "true")  # Opus 패스스루 재생 모드
+AUDIO_NODE = os.getenv("audio_node")  # 오디오 노드 주소 (unix:/경로 또는 tcp:호스트:포트), 지정하면 FFmpeg/인코딩을 노드에서 처리
+OPUS_SILENCE = b"\xf8\xff\xfe"  # 노드 패킷이 늦을 때 대신 보내는 Opus 무음 프레임
+STREAM_EXPIRY_MARGIN = 300  # 곡 길이에 더해 남아 있어야 하는 최소 유효 시간 (초)
+REFRESH_LOOKAHEAD = 2       # 재생 중 미리 스트림 URL을 확인/갱신할 대기열 앞쪽 곡 수
+
+# 곡 전환 사전 준비 (gapless) 설정
+PREWARM_LEAD = 5.0    # 현재 곡이 이만큼(초) 남았을 때 다음 곡 소스를 미리 연다
+PREWARM_FRAMES = 50   # 미리 읽어 둘 프레임 수 (20ms 단위, 50 = 1초)
+
+MAX_QUEUE_LENGTH = int(os.getenv("max_queue_length", "5000"))  # 길드당 대기열 최대 곡 수
+# 유휴 길드 정리: 재생 없음/일시정지/청취자 없음 상태가 이 시간(초) 이상 지속되면 퇴장
+IDLE_TIMEOUT = int(os.getenv("idle_timeout", "300"))
+IDLE_CHECK_INTERVAL = 30
+QUEUE_PAGE_SIZE = 10  # 대기열 화면 한 페이지에 표시하는 곡 수
+QUEUE_TITLE_LIMIT = 80  # 대기열 화면에서 곡 제목 최대 길이 (임베드/메시지 길이 제한 대비)
+UI_UPDATE_DELAY = 0.5  # nowplaying 임베드 갱신 요청을 모아 한 번에 수정하는 대기 시간 (초)
+
+# 자동재생 믹스 구간 캐시 설정
+MIX_WINDOW_SIZE = int(os.getenv("autoplay_window", "10"))  # 한 번에 가져오는 믹스 항목 수
+MIX_WINDOW_REFILL_AT = 3     # 남은 항목이 이 수 이하이면 다음 구간을 미리 가져옴
+MIX_WINDOW_TTL = 3600        # 믹스 구간 보관 시간 (초)
+MIX_WINDOW_CACHE_SIZE = 512  # 보관하는 기준 곡(믹스) 수
+MIX_WINDOW_MAX_ENTRIES = 4 * MIX_WINDOW_SIZE  # 구간 하나가 보관하는 최대 항목 수
+
+def extract_video_id(url):
+    """YouTube 단일 영상 URL에서 video id를 추출 (플레이리스트/검색어는 None)"""
+    parsed = urlparse(url)
+    host = parsed.netloc.lower()
+    if host.endswith("youtu.be"):
+        return parsed.path.lstrip("/").split("/")[0] or None
+    if not host.endswith("youtube.com"):
+        return None
+    if parsed.path == "/watch":
+        return parse_qs(parsed.query).get("v", [None])[0]
+    if parsed.path.startswith(("/shorts/", "/live/")):
+        return parsed.path.split("/")[2] or None
+    return None
+
+def search_query_key(text):
+    """URL이 아닌 입력(검색어)이면 대소문자/공백을 정규화한 키를 반환, URL이면 None"""
+    text = text.strip()
+    # yt-dlp의 default_search=auto와 같은 기준: 프로토콜이 없어도 '도메인/경로' 형태면 URL로 취급
+    if "://" in text or re.match(r"^[^\s/]+\.[^\s/]+/", text):
+        return None
+    return " ".join(text.casefold().split()) or None
+
+def stream_url_expiry(url):
+    """googlevideo 스트림 URL의 expire 파라미터(UNIX 시간)를 반환, 없으면 기본 유효 시간 적용"""
+    expire = parse_qs(urlparse(url).query).get("expire")
+    if expire:
+        try:
+            return float(expire[0])
+        except ValueError:
+            pass
+    return time.time() + DEFAULT_STREAM_TTL
+
+# 지표 엔드포인트 (Prometheus 텍스트 형식, localhost 전용). 0이면 비활성, 클러스터 모드에서는 metrics_port + cluster_id
+METRICS_PORT = int(os.getenv("metrics_port", "0"))
+if METRICS_PORT:
+    METRICS_PORT += CLUSTER_ID
+EXTRACTION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # 추출 지연 히스토그램 구간 (초)
+
+class Histogram:
+    """라벨 하나로 나뉘는 누적 히스토그램 (이벤트 루프에서만 갱신)"""
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.series = {}  # 라벨 값 -> [구간별 개수..., 합계, 전체 개수]
+
+    def observe(self, value, seconds):
+        series = self.series.get(value)
+        if series is None:
+            series = self.series[value] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, value):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(value, time.perf_counter() - started)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, series in self.series.items():
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="+Inf"}} {series[-1]}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {series[-1]}')
+        return lines
+
+def render_metric(name, kind, help, samples):
+    """samples: [(라벨 dict, 값)]을 Prometheus 텍스트 줄로 변환"""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+extraction_latency = Histogram("musicbot_extraction_seconds", "yt-dlp 추출 소요 시간 (캐시 적중 포함)", "kind",
+                               EXTRACTION_BUCKETS)
+ffmpeg_sources = weakref.WeakSet()  # 생성된 FFmpeg 오디오 소스 (실행 중인 프로세스 수 집계용)
+
+class Track:
+    """
+    대기열에 보관하는 경량 트랙 정보.
+    FFmpeg 프로세스는 만들지 않고, 재생 직전에 YTDLSource.from_track으로 오디오 소스를 생성합니다.
+    """
+    __slots__ = ("id", "title", "duration", "video_url", "thumbnail", "_stream_url", "expires_at", "codec", "autoplay")
+
+    def __init__(self, id, title, duration, video_url, thumbnail, stream_url=None, codec=None, autoplay=False):
+        self.id = id
+        self.title = title
+        self.duration = duration
+        self.video_url = video_url
+        self.thumbnail = thumbnail
+        self.stream_url = stream_url
+        self.codec = codec
+        self.autoplay = autoplay
+
+    @classmethod
+    def from_info(cls, data):
+        video_id = data.get("id")
+        return cls(
+            id=video_id,
+            title=data.get("title", "제목 없음"),
+            duration=int(data.get("duration") or 0),
+            video_url=data.get("webpage_url") or (f"https://www.youtube.com/watch?v={video_id}" if video_id else "https://www.youtube.com/"),
+            thumbnail=data.get("thumbnail", "https://i.imgur.com/Tt6jwFk.png"),
+            stream_url=data.get("url"),
+            codec=data.get("acodec"),
+        )
+
+    @classmethod
+    def from_flat_entry(cls, entry):
+        """extract_flat 항목에서 생성 (스트림 URL은 재생 직전에 resolve로 채움)"""
+        video_id = entry.get("id")
+        if entry.get("ie_key", "Youtube") == "Youtube" and video_id:
+            video_url = f"https://www.youtube.com/watch?v={video_id}"
+        else:
+            video_url = entry.get("url")
+        thumbnails = entry.get("thumbnails") or []
+        return cls(
+            id=video_id,
+            title=entry.get("title") or "제목 없음",
+            duration=int(entry.get("duration") or 0),
+            video_url=video_url,
+            thumbnail=thumbnails[-1].get("url") if thumbnails else "https://i.imgur.com/Tt6jwFk.png",
+        )
+
+    @property
+    def stream_url(self):
+        return self._stream_url
+
+    @stream_url.setter
+    def stream_url(self, url):
+        self._stream_url = url
+        self.expires_at = stream_url_expiry(url) if url else 0.0
+
+    def update_stream(self, resolved):
+        """다시 추출한 트랙 정보(resolved)의 스트림 관련 필드를 이 트랙에 반영"""
+        self.stream_url = resolved.stream_url
+        self.codec = resolved.codec
+        self.thumbnail = resolved.thumbnail
+        self.duration = resolved.duration or self.duration
+
+    def is_stream_fresh(self, margin=STREAM_EXPIRY_MARGIN, at=None):
+        """at 시점(기본: 지금)에 재생을 시작해도 곡이 끝날 때까지 스트림 URL이 유효한지 확인"""
+        if self._stream_url is None:
+            return False
+        return self.expires_at - (at or time.time()) > self.duration + margin
+
+    def to_record(self):
+        return {
+            "id": self.id,
+            "title": self.title,
+            "duration": self.duration,
+            "video_url": self.video_url,
+            "thumbnail": self.thumbnail,
+            "stream_url": self._stream_url,
+            "codec": self.codec,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(**record)
+
+    def memory_usage(self):
+        """이 트랙 정보가 차지하는 대략적인 메모리 (바이트)"""
+        return sys.getsizeof(self) + sum(sys.getsizeof(value) for value in
+                                         (self.id, self.title, self.video_url, self.thumbnail, self._stream_url, self.codec))
+
+class ExtractionCache:
+    """
+    video id 기준 추출 결과 캐시 (메모리 LRU + SQLite 디스크 저장).
+    스트림 URL의 expire 값이 지난 항목은 메타데이터만 돌려주고 stream_url은 비워서,
+    만료된 URL이 FFmpeg로 전달되지 않도록 합니다.
+    추출 워커 프로세스와 다른 도구도 이 모듈을 import하므로, SQLite 파일은 생성 시점이 아니라
+    봇 프로세스에서 open()하거나 처음 조회/저장할 때 엽니다.
+    """
+    def __init__(self, path, capacity=EXTRACTION_CACHE_SIZE):
+        self.path = path
+        self.capacity = capacity
+        self.memory = OrderedDict()  # video_id -> record
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+
+    def _connect(self):
+        """lock을 잡은 상태에서 호출"""
+        if self.db is not None:
+            return
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "video_id TEXT PRIMARY KEY, record TEXT NOT NULL, expires_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.db.execute("DELETE FROM tracks WHERE updated_at < ?", (time.time() - EXTRACTION_CACHE_MAX_AGE,))
+        self.db.commit()
+
+    def open(self):
+        """디스크 캐시를 열고 오래된 항목을 정리 (블로킹되므로 executor에서 호출)"""
+        with self.lock:
+            self._connect()
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    def _remember(self, video_id, record):
+        self.memory[video_id] = record
+        self.memory.move_to_end(video_id)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get(self, video_id):
+        """
+        캐시된 Track 사본을 반환합니다. 스트림 URL이 만료(임박)된 경우 stream_url=None인 메타데이터만 반환합니다.
+        캐시에 없으면 None.
+        """
+        if not video_id:
+            return None
+        with self.lock:
+            record = self.memory.get(video_id)
+            if record is None:
+                self._connect()
+                row = self.db.execute("SELECT record FROM tracks WHERE video_id = ?", (video_id,)).fetchone()
+                if row is not None:
+                    record = json.loads(row[0])
+                    self._remember(video_id, record)
+            else:
+                self.memory.move_to_end(video_id)
+        if record is None:
+            self.misses += 1
+            return None
+        track = Track.from_record(record)
+        if track.is_stream_fresh():
+            self.hits += 1
+        else:
+            self.misses += 1
+            track.stream_url = None
+        return track
+
+    def put(self, track):
+        if not track.id or not track.stream_url:
+            return
+        record = track.to_record()
+        with self.lock:
+            self._remember(track.id, record)
+            self._connect()
+            self.db.execute(
+                "INSERT OR REPLACE INTO tracks (video_id, record, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+                (track.id, json.dumps(record, ensure_ascii=False), track.expires_at, time.time())
+            )
+            self.db.commit()
+
+extraction_cache = ExtractionCache(EXTRACTION_CACHE_PATH)  # 파일은 봇 프로세스의 cog_load에서 엶
+
+class SearchCache:
+    """정규화한 검색어 -> video id 캐시 (메모리 LRU, 항목마다 ttl초 후 만료)"""
+    def __init__(self, capacity=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries = OrderedDict()  # query -> (video_id, 저장 시각)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        entry = self.entries.get(query)
+        if entry is not None and time.time() - entry[1] > self.ttl:
+            del self.entries[query]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(query)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, query, video_id):
+        if not video_id:
+            return
+        self.entries[query] = (video_id, time.time())
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+search_cache = SearchCache()
+
+class QueueJournal:
+    """
+    길드 대기열 스냅샷을 JSON lines 파일에 덧붙여 기록하는 저널.
+    줄마다 전체 스냅샷이거나, 직전 상태에서 앞쪽 곡을 꺼내고(popped) 뒤쪽에 곡을 추가한(appended) 차이만 담은 기록이고,
+    해제된 길드는 삭제 표시 줄을 남깁니다.
+    시작할 때 최신 스냅샷만 남도록 파일을 다시 쓰고, 대기열은 길드가 처음 사용될 때 복원합니다.
+    파일을 다시 쓰므로 봇 프로세스에서 한 번만 만듭니다. (spawn된 워커 프로세스가 모듈을 import할 때 만들면 안 됨)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.snapshots = {}  # guild_id -> 아직 복원하지 않은 스냅샷
+        self.size = 0            # 현재 파일 크기 (바이트)
+        self.compacted_size = 0  # 마지막으로 다시 쓴 직후의 파일 크기
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 기록 도중 중단된 줄
+                    guild_id = record["guild"]
+                    if record.get("deleted"):
+                        self.snapshots.pop(guild_id, None)
+                    elif "popped" in record:
+                        base = self.snapshots.get(guild_id)
+                        if base is not None:
+                            self.snapshots[guild_id] = self.apply_delta(base, record)
+                    else:
+                        self.snapshots[guild_id] = record
+        except FileNotFoundError:
+            pass
+        self.compact(list(self.snapshots.values()))
+
+    @staticmethod
+    def apply_delta(base, delta):
+        snapshot = dict(delta, queue=base["queue"][delta["popped"]:] + delta["appended"])
+        del snapshot["popped"], snapshot["appended"]
+        return snapshot
+
+    def needs_compaction(self):
+        return self.size > max(QUEUE_JOURNAL_COMPACT_BYTES, 2 * self.compacted_size)
+
+    @staticmethod
+    def _dump(records):
+        return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+
+    def append(self, records):
+        data = self._dump(records).encode("utf-8")
+        with self.lock:
+            with open(self.path, "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.size += len(data)
+
+    def compact(self, records):
+        """records(길드별 최신 스냅샷)만 남기도록 파일을 원자적으로 다시 씀"""
+        data = self._dump(records).encode("utf-8")
+        tmp_path = self.path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.size = self.compacted_size = len(data)
+
+    def restore(self, guild_id):
+        """복원할 스냅샷을 꺼냄 (없으면 None). 이후 상태는 길드 플레이어가 다시 기록"""
+        return self.snapshots.pop(guild_id, None)
+
+def download_audio(url, directory):
+    """곡의 오디오만 directory에 내려받고 (파일 경로, 코덱, 크기)를 반환"""
+    options = dict(ytdl_format_options, format="bestaudio[acodec=opus]/bestaudio", skip_download=False,
+                   noplaylist=True, outtmpl=os.path.join(directory, "%(id)s.%(ext)s"))
+    with youtube_dl.YoutubeDL(options) as ydl:
+        info = ydl.extract_info(url, download=True)
+        if not info:
+            raise RuntimeError("오디오를 내려받지 못함")
+        downloads = info.get("requested_downloads") or [{}]
+        path = downloads[0].get("filepath") or ydl.prepare_filename(info)
+    return path, info.get("acodec"), os.path.getsize(path)
+
+class AudioCache:
+    """
+    자주 재생되는 곡의 오디오를 디스크에 보관하는 캐시 (video id 기준).
+    곡이 min_plays번 재생되면 백그라운드에서 내려받고, 이후에는 YouTube 스트리밍 대신 로컬 파일로 재생합니다.
+    전체 크기가 capacity를 넘으면 가장 오래전에 재생된 파일부터 지웁니다. (LRU)
+    클러스터 모드에서는 여러 프로세스가 같은 디렉터리를 쓰므로, 파일 목록/크기/내려받는 중 표시는
+    모두 공유 SQLite 색인에만 두고 프로세스 메모리에는 보관하지 않습니다.
+    """
+    def __init__(self, directory, capacity=AUDIO_CACHE_SIZE, min_plays=AUDIO_CACHE_MIN_PLAYS):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.capacity = capacity
+        self.min_plays = min_plays
+        self.hits = 0
+        self.misses = 0
+        self.executor = ThreadPoolExecutor(max_workers=AUDIO_CACHE_DOWNLOADS, thread_name_prefix="audio-cache")
+        self.lock = threading.Lock()
+        # 자동 커밋 모드: 여러 문장을 함께 바꿔야 하는 곳만 BEGIN IMMEDIATE로 묶음
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), check_same_thread=False,
+                                  isolation_level=None, timeout=10)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS audio ("
+            "video_id TEXT PRIMARY KEY, plays INTEGER NOT NULL, last_played REAL NOT NULL, "
+            "path TEXT, codec TEXT, size INTEGER NOT NULL DEFAULT 0, downloading REAL)"
+        )
+        if "downloading" not in [row[1] for row in self.db.execute("PRAGMA table_info(audio)")]:
+            self.db.execute("ALTER TABLE audio ADD COLUMN downloading REAL")
+        self.db.execute("DELETE FROM audio WHERE path IS NULL AND last_played < ?",
+                        (time.time() - AUDIO_CACHE_PLAYS_MAX_AGE,))
+
+    @property
+    def total_size(self):
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM audio WHERE path IS NOT NULL").fetchone()[0]
+
+    def lookup(self, video_id):
+        """캐시된 (파일 경로, 코덱)을 반환, 없으면 None. 다른 프로세스가 지운 파일은 색인에서도 지움"""
+        if not video_id:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT path, codec FROM audio WHERE video_id = ? AND path IS NOT NULL",
+                                  (video_id,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                self.db.execute("UPDATE audio SET path = NULL, size = 0 WHERE video_id = ? AND path = ?",
+                                (video_id, row[0]))
+                return None
+        return row
+
+    def record_play(self, track):
+        """재생 횟수를 기록하고, 기준 횟수에 도달한 곡은 백그라운드에서 내려받음"""
+        if not track.id:
+            return
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO audio (video_id, plays, last_played) VALUES (?, 1, ?) "
+                "ON CONFLICT(video_id) DO UPDATE SET plays = plays + 1, last_played = excluded.last_played",
+                (track.id, now)
+            )
+            plays, path = self.db.execute("SELECT plays, path FROM audio WHERE video_id = ?", (track.id,)).fetchone()
+            if path is not None:
+                self.hits += 1
+                return
+            self.misses += 1
+            if plays < self.min_plays or not 0 < track.duration <= AUDIO_CACHE_MAX_DURATION:
+                return
+            # 다른 프로세스가 이미 내려받는 중이면 건너뜀 (중단된 표시는 AUDIO_CACHE_DOWNLOAD_TIMEOUT 뒤 무시)
+            claimed = self.db.execute(
+                "UPDATE audio SET downloading = ? WHERE video_id = ? AND path IS NULL "
+                "AND (downloading IS NULL OR downloading < ?)",
+                (now, track.id, now - AUDIO_CACHE_DOWNLOAD_TIMEOUT)
+            ).rowcount
+        if claimed:
+            asyncio.create_task(self.store(track))
+
+    async def store(self, track):
+        loop = asyncio.get_running_loop()
+        try:
+            path, codec, size = await loop.run_in_executor(self.executor, download_audio, track.video_url, self.directory)
+        except Exception as e:
+            log.warning("오디오 캐시 내려받기 실패 (%s): %s", track.title, e)
+            with self.lock:
+                self.db.execute("UPDATE audio SET downloading = NULL WHERE video_id = ?", (track.id,))
+            return
+        with self.lock:
+            if size > self.capacity:
+                self.db.execute("UPDATE audio SET downloading = NULL WHERE video_id = ?", (track.id,))
+                os.remove(path)
+                return
+            self.db.execute("UPDATE audio SET path = ?, codec = ?, size = ?, downloading = NULL WHERE video_id = ?",
+                            (path, codec, size, track.id))
+        log.info("오디오 캐시 저장: %s (%.1fMB, 전체 %.1fMB)", track.title, size / 1048576, self.total_size / 1048576)
+        self.evict()
+
+    def evict(self):
+        """
+        전체 크기가 capacity 이하가 될 때까지 가장 오래전에 재생된 파일을 삭제 (재생 중인 파일은 열린 채로 유지됨).
+        여러 프로세스가 동시에 같은 계산으로 지우지 않도록 색인 갱신은 한 트랜잭션에서 처리합니다.
+        """
+        victims = []
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                excess = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM audio WHERE path IS NOT NULL").fetchone()[0]
+                excess -= self.capacity
+                rows = self.db.execute(
+                    "SELECT video_id, path, size FROM audio WHERE path IS NOT NULL ORDER BY last_played").fetchall()
+                for video_id, path, size in rows:
+                    if excess <= 0:
+                        break
+                    victims.append(path)
+                    excess -= size
+                    self.db.execute("UPDATE audio SET path = NULL, size = 0 WHERE video_id = ?", (video_id,))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        for path in victims:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.db.close()
+
+class MixWindow:
+    """기준 곡 하나의 믹스에서 미리 가져온 연속된 flat 항목 구간 (start번째부터)"""
+    __slots__ = ("start", "entries", "exhausted", "fetched_at", "refill_task")
+
+    def __init__(self, start, entries):
+        self.start = start
+        self.entries = entries
+        self.exhausted = len(entries) < MIX_WINDOW_SIZE
+        self.fetched_at = time.time()
+        self.refill_task = None
+
+    @property
+    def end(self):
+        return self.start + len(self.entries)
+
+    def get(self, index):
+        if self.start <= index < self.end:
+            return self.entries[index - self.start]
+        return None
+
+    def extend(self, entries):
+        self.entries.extend(entries)
+        self.exhausted = len(entries) < MIX_WINDOW_SIZE
+        # 오래전에 지나간 앞쪽 항목은 버려서 구간 크기를 제한
+        overflow = len(self.entries) - MIX_WINDOW_MAX_ENTRIES
+        if overflow > 0:
+            del self.entries[:overflow]
+            self.start += overflow
+
+mix_windows = OrderedDict()  # mix_url -> MixWindow
+
+class YTDLPool:
+    """
+    옵션 프로필(full, flat, mix)별로 만들어 둔 YoutubeDL 인스턴스를 재사용하는 풀.
+    호출마다 새로 만들면 추출기 등록과 쿠키/세션 설정을 반복하고 HTTP keep-alive 연결도 버리게 되므로,
+    추출 스레드가 인스턴스를 하나씩 빌려 쓰고 반납합니다. (한 인스턴스는 동시에 한 스레드만 사용)
+    """
+    def __init__(self, profiles):
+        self.profiles = profiles
+        self.idle = {name: queue.SimpleQueue() for name in profiles}
+
+    def acquire(self, profile):
+        try:
+            return self.idle[profile].get_nowait()
+        except queue.Empty:
+            return youtube_dl.YoutubeDL(self.profiles[profile])
+
+    def release(self, profile, ydl):
+        self.idle[profile].put(ydl)
+
+    @contextmanager
+    def checkout(self, profile, **params):
+        """params로 이번 호출에만 적용할 옵션을 덮어쓰고, 반납할 때 원래 값으로 되돌립니다."""
+        ydl = self.acquire(profile)
+        overridden = {key: ydl.params.get(key) for key in params}
+        ydl.params.update(params)
+        try:
+            yield ydl
+        finally:
+            ydl.params.update(overridden)
+            self.release(profile, ydl)
+
+# 워커 프로세스마다 각자의 풀을 가짐
+ytdl_pool = YTDLPool({"full": ytdl_format_options, "flat": ytdl_flat_options, "mix": ytdl_mix_options})
+
+# 아래 추출 함수들은 워커 프로세스에서도 실행될 수 있도록 모듈 최상위에 두고,
+# yt-dlp 결과 전체 대신 피클 가능한 작은 레코드(dict)만 반환합니다.
+def extract_tracks(url, download=False):
+    """
+    URL을 전체 추출하여 (Track 레코드 목록, 경고 메시지 또는 None)을 반환합니다.
+    플레이리스트는 재생 가능한 항목만 남깁니다.
+    """
+    with ytdl_pool.checkout("full") as ydl:
+        data = ydl.extract_info(url, download=download)
+    if not data:
+        return [], None
+    if "entries" in data:
+        valid_entries = [entry for entry in data["entries"]
+                         if entry and "url" in entry and entry.get("availability", "public") != "private"
+                         and not entry.get("requires_premium", False)]
+        if not valid_entries:
+            return [], "⚠️ 플레이리스트 내 유효한 곡이 없음 (모두 삭제됨 또는 프리미엄 전용)"
+        return [Track.from_info(entry).to_record() for entry in valid_entries], None
+    if data.get("requires_premium", False):
+        return [], "⚠️ 프리미엄 전용 영상은 재생할 수 없음"
+    if "url" not in data:
+        return [], None
+    warning = None if data.get("related_videos") else "⚠️ 관련 영상이 존재하지 않음 (빈 리스트 반환)"
+    return [Track.from_info(data).to_record()], warning
+
+def extract_flat_entries(url, start, end):
+    """플레이리스트(믹스)의 start~end 번째 항목을 flat 모드로 조회하여 {id, title, url} 목록을 반환"""
+    with ytdl_pool.checkout("mix", playliststart=start, playlistend=end) as ydl:
+        data = ydl.extract_info(url, download=False)
+    if not data or "entries" not in data:
+        return None
+    return [{"id": entry.get("id"), "title": entry.get("title", "제목 없음"), "url": entry.get("url")}
+            for entry in data["entries"] if entry]
+
+class ExtractionScheduler:
+    """
+    yt-dlp 추출 전용 스케줄러.
+    asyncio 기본 스레드 풀 대신 전용 스레드 풀(workers개)에서 실행하며,
+    우선순위(사용자 요청 > 자동재생 > prefetch) 순으로, 같은 우선순위 안에서는 길드별 라운드로빈으로 작업을 꺼냅니다.
+    backend가 process면 portable 작업(모듈 최상위 추출 함수)은 워커 프로세스 풀에서 실행하여
+    yt-dlp의 CPU 작업이 이벤트 루프 및 voice 전송 스레드와 GIL을 다투지 않게 합니다.
+    """
+    def __init__(self, workers=EXTRACTION_WORKERS, backend=EXTRACTION_BACKEND):
+        self.workers = workers
+        self.backend = backend
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ytdl")
+        self.process_executor = None
+        self.pending = [OrderedDict() for _ in range(PRIORITY_PREFETCH + 1)]  # 우선순위별 {guild_id: deque[job]}
+        self.tagged = {}  # tag -> (우선순위, guild_id, job): 아직 대기 중인 작업의 위치 (우선순위 올리기용)
+        self.depth = 0
+        self.running = 0
+        self.promoted = 0
+        self.wait_times = deque(maxlen=256)  # 최근 작업들의 대기 시간 (초)
+        self.available = None
+        self.worker_tasks = []
+
+    def _ensure_started(self):
+        if self.worker_tasks:
+            return
+        self.available = asyncio.Semaphore(0)
+        if self.backend == "process":
+            self.process_executor = self._create_process_pool()
+        self.worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def _create_process_pool(self):
+        # 이벤트 루프/voice 스레드가 도는 프로세스를 fork하지 않도록 spawn 사용
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_broken_pool(self, broken):
+        """워커 프로세스가 죽어(OOM 등) 망가진 프로세스 풀을 새로 만듦. 다른 워커가 이미 교체했으면 그대로 둠"""
+        if self.process_executor is not broken:
+            return
+        log.warning("추출 워커 프로세스 풀이 중단되어 다시 생성합니다.")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.process_executor = self._create_process_pool()
+
+    def shutdown(self):
+        """워커 작업과 프로세스 풀을 정리. 대기 중인 작업은 취소되며, 다음 run() 호출 시 다시 시작됨"""
+        for task in self.worker_tasks:
+            task.cancel()
+        self.worker_tasks = []
+        for guilds in self.pending:
+            for jobs in guilds.values():
+                for job in jobs:
+                    job[3].cancel()
+            guilds.clear()
+        self.tagged.clear()
+        self.depth = 0
+        if self.process_executor is not None:
+            self.process_executor.shutdown(wait=False, cancel_futures=True)
+            self.process_executor = None
+
+    async def run(self, func, *args, guild_id=None, priority=PRIORITY_USER, portable=False, tag=None):
+        """
+        func(*args)를 추출 워커에서 실행하고 결과를 반환.
+        portable=True는 func와 인자, 결과가 모두 피클 가능하여 워커 프로세스에서 실행해도 된다는 뜻입니다.
+        tag를 지정하면 대기 중인 동안 promote(tag, priority)로 우선순위를 올릴 수 있습니다.
+        """
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        job = (portable, func, args, future, time.perf_counter(), tag)
+        self.pending[priority].setdefault(guild_id, deque()).append(job)
+        if tag is not None:
+            self.tagged[tag] = (priority, guild_id, job)
+        self.depth += 1
+        self.available.release()
+        return await future
+
+    def _next_job(self):
+        for guilds in self.pending:
+            if not guilds:
+                continue
+            guild_id, jobs = next(iter(guilds.items()))
+            job = jobs.popleft()
+            if jobs:
+                guilds.move_to_end(guild_id)  # 같은 우선순위의 다른 길드에게 차례를 넘김
+            else:
+                del guilds[guild_id]
+            self.depth -= 1
+            if job[5] is not None:
+                self.tagged.pop(job[5], None)
+            return job
+        return None
+
+    def promote(self, tag, priority):
+        """tag 작업이 아직 대기 중이고 priority보다 낮은 우선순위면 priority 대기열로 옮김"""
+        entry = self.tagged.get(tag)
+        if entry is None or entry[0] <= priority:
+            return
+        old_priority, guild_id, job = entry
+        jobs = self.pending[old_priority][guild_id]
+        jobs.remove(job)
+        if not jobs:
+            del self.pending[old_priority][guild_id]
+        self.pending[priority].setdefault(guild_id, deque()).append(job)
+        self.tagged[tag] = (priority, guild_id, job)
+        self.promoted += 1
+
+    async def _execute(self, portable, func, args):
+        loop = asyncio.get_running_loop()
+        if not portable or self.process_executor is None:
+            return await loop.run_in_executor(self.executor, func, *args)
+        executor = self.process_executor
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # 풀이 망가지면 이후 모든 추출이 실패하므로 새 풀을 만들고 이 작업을 한 번 다시 실행
+            self._replace_broken_pool(executor)
+            return await loop.run_in_executor(self.process_executor, func, *args)
+
+    async def _worker(self):
+        while True:
+            await self.available.acquire()
+            portable, func, args, future, queued_at, _ = self._next_job()
+            if future.done():  # 요청한 쪽이 이미 취소됨
+                continue
+            self.wait_times.append(time.perf_counter() - queued_at)
+            self.running += 1
+            try:
+                result = await self._execute(portable, func, args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+
+    def stats(self):
+        waits = list(self.wait_times)
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "queue_depth": self.depth,
+            "running": self.running,
+            "promoted": self.promoted,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_max": max(waits, default=0.0),
+        }
+
+extraction_scheduler = ExtractionScheduler()
+
+class SingleFlight:
+    """
+    같은 키의 작업이 이미 진행 중이면 새로 시작하지 않고 진행 중인 작업의 결과를 함께 받게 합니다.
+    작업은 별도 태스크로 실행되므로 기다리던 호출 하나가 취소되어도 나머지 호출에는 영향이 없습니다.
+    처음 시작한 호출보다 높은 우선순위의 호출이 합류하면 promote(key, priority)로 대기 중인 작업의 우선순위를 올립니다.
+    """
+    def __init__(self, promote=None):
+        self.flights = {}  # key -> [task, 우선순위]
+        self.promote = promote
+        self.calls = 0
+        self.shared = 0
+
+    async def run(self, key, func, *args, priority=PRIORITY_USER, **kwargs):
+        """func(*args, priority=priority, **kwargs)를 실행하거나 진행 중인 같은 key 작업에 합류"""
+        self.calls += 1
+        flight = self.flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(func(*args, priority=priority, **kwargs))
+            flight = self.flights[key] = [task, priority]
+            task.add_done_callback(lambda done: self.flights.pop(key, None)
+                                   if self.flights.get(key, (None,))[0] is done else None)
+        else:
+            self.shared += 1
+            log.debug("진행 중인 추출에 합류: %s", key)
+            self.boost(key, priority)
+        return await asyncio.shield(flight[0])
+
+    def boost(self, key, priority):
+        """진행 중인 key 작업을 priority 이상의 우선순위로 올림 (없으면 무시)"""
+        flight = self.flights.get(key)
+        if flight is not None and priority < flight[1]:
+            flight[1] = priority
+            if self.promote is not None:
+                self.promote(key, priority)
+
+extraction_flights = SingleFlight(promote=extraction_scheduler.promote)
+
+def mix_window_key(mix_url, start):
+    return "mix", mix_url, start, start + MIX_WINDOW_SIZE - 1
+
+def extraction_key(url):
+    """동시 추출을 합치기 위한 정규화 키: 플레이리스트 id > video id > URL(검색어) 순"""
+    parsed = urlparse(url)
+    if parsed.netloc.lower().endswith(("youtube.com", "youtu.be")):
+        list_id = parse_qs(parsed.query).get("list", [None])[0]
+        if list_id:
+            return "playlist", list_id
+    video_id = extract_video_id(url)
+    if video_id:
+        return "video", video_id
+    query = search_query_key(url)
+    if query:
+        return "search", query
+    return "url", url.strip()
+
+class PrimedAudio(discord.AudioSource):
+    """
+    FFmpeg 오디오를 감싸서 재생 전에 앞부분 프레임을 미리 읽어 둘 수 있게 하는 래퍼.
+    prime()은 FFmpeg 실행, HTTP 연결, 프로브가 끝날 때까지 블로킹되므로 executor에서 호출합니다.
+    """
+    def __init__(self, original):
+        self.original = original
+        self.buffer = deque()
+        ffmpeg_sources.add(original)
+
+    def prime(self, frames=PREWARM_FRAMES):
+        for _ in range(frames):
+            data = self.original.read()
+            if not data:
+                break
+            self.buffer.append(data)
+
+    def read(self):
+        if self.buffer:
+            return self.buffer.popleft()
+        return self.original.read()
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.buffer.clear()
+        self.original.cleanup()
 
 class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
+    def __init__(self, source, *, track, volume=0.5):
         super().__init__(source, volume)
-        self.data = data
-        self.title = data.get("title", "제목 없음")
-        self.url = data.get("url")
-        self.video_url = data.get("webpage_url", "https://www.youtube.com/")
-        self.thumbnail = data.get("thumbnail", "https://i.imgur.com/Tt6jwFk.png")
-        self.related_videos = data.get("related_videos", [])
+        self.track = track
+        self.title = track.title
+        self.url = track.stream_url
+        self.video_url = track.video_url
+        self.thumbnail = track.thumbnail
+        self._frames = 0
+        self.on_first_frame = None  # 첫 프레임을 읽을 때 voice 스레드에서 한 번 호출 (곡 전환 간격 측정용)
+
+    @classmethod
+    def from_track(cls, track, *, volume=0.5, url=None):
+        """재생 직전에 호출하여 트랙의 FFmpeg 오디오 소스를 생성 (url: 스트림 대신 재생할 로컬 파일)"""
+        url = url or track.stream_url
+        audio = discord.FFmpegPCMAudio(url, before_options=ffmpeg_before_options(url), options=ffmpeg_options['options'])
+        return cls(PrimedAudio(audio), track=track, volume=volume)
+
+    @property
+    def elapsed(self):
+        return self._frames * FRAME_LENGTH
+
+    def prime(self, frames=PREWARM_FRAMES):
+        self.original.prime(frames)
+
+    def read(self):
+        data = super().read()
+        if data:
+            self._frames += 1
+            if self.on_first_frame is not None:
+                callback, self.on_first_frame = self.on_first_frame, None
+                callback()
+        return data
     
+    @staticmethod
+    async def extract(url, *, download=False, guild_id=None, priority=PRIORITY_USER):
+        """
+        extract_tracks를 추출 워커에서 실행. 같은 곡/플레이리스트의 추출이 진행 중이면 그 결과를 함께 사용합니다.
+        결과는 레코드(dict)이므로 호출한 쪽마다 별도의 Track을 만들어 씁니다.
+        """
+        key = (extraction_key(url), download)
+        return await extraction_flights.run(key, extraction_scheduler.run, extract_tracks, url, download,
+                                            guild_id=guild_id, priority=priority, portable=True, tag=key)
+
+    @staticmethod
+    async def extract_mix_window(mix_url, start, *, guild_id=None, priority=PRIORITY_AUTOPLAY):
+        """믹스의 start번째부터 MIX_WINDOW_SIZE개 flat 항목을 조회 (같은 구간 조회는 하나로 합침)"""
+        key = mix_window_key(mix_url, start)
+        return await extraction_flights.run(key, extraction_scheduler.run, extract_flat_entries, mix_url, start, key[3],
+                                            guild_id=guild_id, priority=priority, portable=True, tag=key)
+
+    @classmethod
+    async def from_url(cls, url, *, stream=False, guild_id=None, priority=PRIORITY_USER):
+        with extraction_latency.time("from_url"):
+            return await cls._from_url(url, stream=stream, guild_id=guild_id, priority=priority)
+
     @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        ytdl_inst = youtube_dl.YoutubeDL(ytdl_format_options)
+    async def _from_url(cls, url, *, stream, guild_id, priority):
+        # 검색어는 이전 검색 결과가 있으면 검색 없이 해당 영상 URL로 바로 추출
+        query = search_query_key(url)
+        video_id = search_cache.get(query) if query else None
+        if video_id:
+            url = f"https://www.youtube.com/watch?v={video_id}"
+        cached = extraction_cache.get(extract_video_id(url))
+        if cached and cached.stream_url:
+            return [cached]
         try:
-            data = await loop.run_in_executor(None, lambda: ytdl_inst.extract_info(url, download=not stream))
+            records, warning = await cls.extract(url, download=not stream, guild_id=guild_id, priority=priority)
         except Exception as e:
-            print(f"❌ YTDL 에러 발생: {e}")
+            log.error("YTDL 에러 발생: %s", e)
             return []
-        if "entries" in data:
-            valid_entries = [entry for entry in data["entries"]
-                             if entry and "url" in entry and entry.get("availability", "public") != "private"
-                             and not entry.get("requires_premium", False)]
-            if not valid_entries:
-                print("⚠️ 플레이리스트 내 유효한 곡이 없음 (모두 삭제됨 또는 프리미엄 전용)")
-                return []
-            return [cls(discord.FFmpegPCMAudio(entry["url"], **ffmpeg_options), data=entry)
-                    for entry in valid_entries]
-        if data.get("requires_premium", False):
-            print("⚠️ 프리미엄 전용 영상은 재생할 수 없음")
-            return []
-        related_videos = data.get("related_videos", [])
-        if not related_videos:
-            print("⚠️ 관련 영상이 존재하지 않음 (빈 리스트 반환)")
-        return [cls(discord.FFmpegPCMAudio(data["url"], **ffmpeg_options), data=data)] if "url" in data else []
+        if warning:
+            log.warning("%s", warning)
+        tracks = [Track.from_record(record) for record in records]
+        for track in tracks:
+            extraction_cache.put(track)
+        if query and not video_id and len(tracks) == 1:
+            search_cache.put(query, tracks[0].id)
+        return tracks
     
+    @staticmethod
+    def is_playlist_url(url):
+        parsed = urlparse(url)
+        if not parsed.netloc:
+            return False
+        return "list" in parse_qs(parsed.query) or parsed.path.rstrip("/").endswith("/playlist")
+
+    @classmethod
+    async def iter_playlist(cls, url, *, chunk_size=PLAYLIST_CHUNK_SIZE, guild_id=None):
+        """
+        플레이리스트를 flat 모드로 가져와 chunk_size개씩 Track 목록을 yield합니다.
+        process=False로 호출하므로 yt-dlp가 페이지 단위로 항목을 가져오는 동안 앞 항목부터 바로 사용할 수 있습니다.
+        첫 묶음까지는 사용자 요청 우선순위로, 이후 묶음은 백그라운드 우선순위로 추출합니다.
+        """
+        priority = PRIORITY_USER
+        # 항목 iterator가 페이지를 가져올 때 같은 인스턴스를 쓰므로 순회가 끝날 때까지 빌려 둠
+        ytdl_flat = ytdl_pool.acquire("flat")
+        try:
+            try:
+                data = await extraction_scheduler.run(lambda: ytdl_flat.extract_info(url, download=False, process=False),
+                                                      guild_id=guild_id, priority=priority)
+                # watch?v=...&list=... 형태는 플레이리스트 URL로 한 번 더 연결됨
+                for _ in range(3):
+                    if not data or data.get("_type") not in ("url", "url_transparent"):
+                        break
+                    next_url = data["url"]
+                    data = await extraction_scheduler.run(lambda: ytdl_flat.extract_info(next_url, download=False, process=False),
+                                                          guild_id=guild_id, priority=priority)
+            except Exception as e:
+                log.error("YTDL 에러 발생: %s", e)
+                return
+            if not data or "entries" not in data:
+                log.debug("'entries' 키가 데이터에 없습니다.")
+                return
+            entries = iter(data["entries"])
+            while True:
+                try:
+                    chunk = await extraction_scheduler.run(lambda: list(itertools.islice(entries, chunk_size)),
+                                                           guild_id=guild_id, priority=priority)
+                except Exception as e:
+                    log.error("플레이리스트 항목 조회 중 오류: %s", e)
+                    return
+                if not chunk:
+                    return
+                tracks = [Track.from_flat_entry(entry) for entry in chunk
+                          if entry and entry.get("title") not in UNAVAILABLE_TITLES
+                          and entry.get("availability", "public") not in ("private", "premium_only", "subscriber_only", "needs_auth")]
+                if tracks:
+                    yield tracks
+                    priority = PRIORITY_PREFETCH
+        finally:
+            ytdl_pool.release("flat", ytdl_flat)
+
+    @classmethod
+    async def from_playlist_url(cls, url, *, guild_id=None):
+        """
+        첫 번째 항목 묶음만 기다려서 반환하고, 나머지 묶음을 가져오는 async generator를 함께 반환합니다.
+        반환값: (첫 묶음 Track 목록, 나머지 묶음 generator 또는 None)
+        """
+        chunks = cls.iter_playlist(url, guild_id=guild_id)
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return [], None
+        return first_chunk, chunks
+
+    @staticmethod
+    async def chain_chunks(first_chunk, chunks):
+        """첫 묶음과 나머지 묶음 generator(None 가능)를 하나의 묶음 generator로 연결"""
+        try:
+            yield first_chunk
+            if chunks is not None:
+                async for tracks in chunks:
+                    yield tracks
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+
+    @classmethod
+    async def resolve(cls, track, *, at=None, guild_id=None, priority=PRIORITY_USER):
+        """
+        스트림 URL이 없거나(flat 항목) 만료된 트랙을 전체 추출하여 재생 가능한 상태로 채웁니다.
+        at: 재생 예상 시각. 캐시된 URL이 그 시각까지 유효할 때만 캐시를 사용합니다.
+        """
+        with extraction_latency.time("prefetch" if priority == PRIORITY_PREFETCH else "resolve"):
+            return await cls._resolve(track, at=at, guild_id=guild_id, priority=priority)
+
+    @classmethod
+    async def _resolve(cls, track, *, at, guild_id, priority):
+        cached = extraction_cache.get(track.id)
+        if cached and cached.is_stream_fresh(at=at):
+            track.update_stream(cached)
+            return True
+        try:
+            records, _ = await cls.extract(track.video_url, guild_id=guild_id, priority=priority)
+        except Exception as e:
+            log.error("YTDL 에러 발생: %s", e)
+            return False
+        if not records:
+            log.warning("재생할 수 없는 곡: %s", track.title)
+            return False
+        resolved = Track.from_record(records[0])
+        extraction_cache.put(resolved)
+        track.update_stream(resolved)
+        return True
+
     @staticmethod
     def get_youtube_mix_link(video_id):
         return f"https://www.youtube.com/watch?v={video_id}&list=RD{video_id}"
     
     @classmethod
-    async def from_mix_url(cls, mix_url, *, loop=None, stream=False, playliststart=1):
+    async def mix_entry(cls, mix_url, index, *, guild_id=None, priority=PRIORITY_AUTOPLAY):
+        """
+        믹스의 index번째 flat 항목을 반환합니다. (없으면 None)
+        믹스는 MIX_WINDOW_SIZE개 단위 구간으로 한 번에 가져와 캐시해 두고,
+        남은 항목이 MIX_WINDOW_REFILL_AT개 이하가 되면 백그라운드에서 다음 구간을 미리 채웁니다.
+        """
+        window = mix_windows.get(mix_url)
+        if window is not None and time.time() - window.fetched_at > MIX_WINDOW_TTL:
+            window = None
+        if window is not None and index >= window.end and window.refill_task is not None:
+            # 백그라운드 보충 조회가 아직 대기 중이면 이 호출의 우선순위로 올린 뒤 기다림
+            extraction_flights.boost(mix_window_key(mix_url, window.end), priority)
+            await asyncio.shield(window.refill_task)
+        if window is None or window.get(index) is None:
+            if window is not None and window.exhausted and index >= window.end:
+                return None  # 믹스 끝
+            log.debug("믹스 구간 조회: %s (%d~%d)", mix_url, index, index + MIX_WINDOW_SIZE - 1)
+            entries = await cls.extract_mix_window(mix_url, index, guild_id=guild_id, priority=priority)
+            if entries is None:
+                return None
+            window = MixWindow(index, entries)
+            mix_windows[mix_url] = window
+            while len(mix_windows) > MIX_WINDOW_CACHE_SIZE:
+                mix_windows.popitem(last=False)
+        mix_windows.move_to_end(mix_url)
+        entry = window.get(index)
+        if entry is not None and not window.exhausted and window.refill_task is None \
+                and window.end - index <= MIX_WINDOW_REFILL_AT:
+            window.refill_task = asyncio.create_task(cls.refill_mix_window(mix_url, window, guild_id=guild_id))
+        return entry
+
+    @classmethod
+    async def refill_mix_window(cls, mix_url, window, *, guild_id=None):
+        """믹스 구간 뒤에 다음 MIX_WINDOW_SIZE개 항목을 이어 붙임"""
+        start = window.end
+        try:
+            entries = await cls.extract_mix_window(mix_url, start, guild_id=guild_id, priority=PRIORITY_PREFETCH)
+            if entries is None:
+                window.exhausted = True
+            else:
+                window.extend(entries)
+        except Exception as e:
+            log.warning("믹스 구간 보충 실패: %s", e)
+        finally:
+            window.refill_task = None
+
+    @classmethod
+    async def from_mix_url(cls, mix_url, *, stream=False, playliststart=1, guild_id=None, priority=PRIORITY_AUTOPLAY):
         """
-        믹스 URL에서 extract_flat 옵션과 함께 'playliststart'만 받아,
-        자동으로 playlistend를 (playliststart)로 설정하여 지정된 항목만 조회합니다.
+        믹스 URL의 'playliststart'번째 항목 1개를 전체 추출하여 반환합니다.
         예: playliststart=2이면 2번 항목만 조회하게 됩니다.
+        믹스 목록 자체는 mix_entry의 구간 캐시에서 가져오므로 곡마다 믹스 페이지를 다시 받지 않습니다.
         """
-        loop = loop or asyncio.get_event_loop()
-        print(f"[DEBUG] from_mix_url 호출됨 with mix_url: {mix_url} (playliststart={playliststart})")
+        with extraction_latency.time("prefetch" if priority == PRIORITY_PREFETCH else "from_mix_url"):
+            return await cls._from_mix_url(mix_url, stream=stream, playliststart=playliststart,
+                                           guild_id=guild_id, priority=priority)
+
+    @classmethod
+    async def _from_mix_url(cls, mix_url, *, stream, playliststart, guild_id, priority):
+        log.debug("from_mix_url 호출됨 with mix_url: %s (playliststart=%d)", mix_url, playliststart)
         try:
-            mix_options = ytdl_format_options.copy()
-            mix_options['extract_flat'] = True
-            mix_options['playliststart'] = playliststart
-            mix_options['playlistend'] = playliststart  # 정확히 1개 항목만 조회
-            ytdl_mix = youtube_dl.YoutubeDL(mix_options)
-            data = await loop.run_in_executor(None, lambda: ytdl_mix.extract_info(mix_url, download=False))
+            entry = await cls.mix_entry(mix_url, playliststart, guild_id=guild_id, priority=priority)
         except Exception as e:
-            print(f"❌ YTDL 에러 발생: {e}")
+            log.error("YTDL 에러 발생: %s", e)
             return []
-        if "entries" in data:
-            entries = data["entries"]
-            full_tracks = []
-            for idx, entry in enumerate(entries, start=1):
-                print(f"[DEBUG] 항목 {idx}: 제목 - {entry.get('title', '제목 없음')}, URL - {entry.get('url')}")
-                try:
-                    full_info = await loop.run_in_executor(None, lambda: ytdl.extract_info(entry["url"], download=False))
-                    if full_info and "url" in full_info:
-                        full_tracks.append(cls(discord.FFmpegPCMAudio(full_info["url"], **ffmpeg_options), data=full_info))
-                except Exception as e:
-                    print(f"[DEBUG] 항목 {idx} 재추출 실패: {e}")
-            print(f"[DEBUG] 재추출 후 총 {len(full_tracks)} 개 트랙 확보됨")
-            return full_tracks
-        print("[DEBUG] 'entries' 키가 데이터에 없습니다.")
-        return []
+        if entry is None:
+            log.debug("믹스에 %d번 항목이 없습니다.", playliststart)
+            return []
+        log.debug("항목 %d: 제목 - %s, URL - %s", playliststart, entry.get('title', '제목 없음'), entry.get('url'))
+        cached = extraction_cache.get(entry.get("id"))
+        if cached and cached.stream_url:
+            return [cached]
+        try:
+            records, _ = await cls.extract(entry["url"], guild_id=guild_id, priority=priority)
+        except Exception as e:
+            log.warning("항목 %d 재추출 실패: %s", playliststart, e)
+            return []
+        if not records:
+            return []
+        track = Track.from_record(records[0])
+        extraction_cache.put(track)
+        return [track]
+
+class OpusPassthroughSource(discord.AudioSource):
+    """
+    Opus 패스스루 재생 소스.
+    원본 코덱이 opus이고 볼륨이 100%면 FFmpeg가 패킷을 그대로 복사(-c:a copy)하여 디코딩/재인코딩 없이 전송하고,
+    그 외에는 FFmpeg 프로세스 안에서 volume 필터와 Opus 인코딩을 처리합니다.
+    어느 경우든 파이썬의 PCM 볼륨 변환과 voice 스레드의 Opus 인코딩은 일어나지 않습니다.
+    """
+    def __init__(self, track, *, volume=1.0, start=0.0, url=None, codec=None):
+        self.track = track
+        self.title = track.title
+        self.url = url or track.stream_url
+        self.codec = codec or track.codec
+        self.video_url = track.video_url
+        self.thumbnail = track.thumbnail
+        self._volume = volume
+        self._start = start
+        self._frames = 0
+        self._lock = threading.Lock()
+        self.on_first_frame = None  # 첫 프레임을 읽을 때 voice 스레드에서 한 번 호출 (곡 전환 간격 측정용)
+        self.original = self._open(start)
+
+    def _open(self, start):
+        return PrimedAudio(open_opus_audio(self.url, self.codec, self._volume, start))
+
+    @property
+    def elapsed(self):
+        return self._start + self._frames * FRAME_LENGTH
+
+    def prime(self, frames=PREWARM_FRAMES):
+        self.original.prime(frames)
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self.set_volume(value)
+
+    def set_volume(self, value):
+        """
+        볼륨이 바뀌면 현재 위치부터 FFmpeg를 다시 열고 앞부분을 미리 읽어 둔 뒤 교체 (패스스루 모드 유지).
+        prime()처럼 블로킹되므로 이벤트 루프에서는 executor로 호출합니다.
+        """
+        value = max(value, 0.0)
+        if value == self._volume:
+            return
+        self._volume = value
+        position = self.elapsed
+        replacement = self._open(position)
+        replacement.prime()
+        with self._lock:
+            if self._volume != value:  # 준비하는 동안 볼륨이 다시 바뀜
+                previous = replacement
+            else:
+                previous, self.original = self.original, replacement
+                self._start, self._frames = position, 0
+        previous.cleanup()
+
+    def read(self):
+        with self._lock:
+            data = self.original.read()
+            if data:
+                self._frames += 1
+                if self.on_first_frame is not None:
+                    callback, self.on_first_frame = self.on_first_frame, None
+                    callback()
+            return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.original.cleanup()
+
+class AudioNodeClient:
+    """
+    오디오 노드(audio_node.py) 연결.
+    노드가 보낸 Opus 패킷과 이벤트를 스트림 id별 NodeAudioSource에 전달하고,
+    연결이 끊기면 재생 중인 소스를 끝낸 뒤 RECONNECT_DELAY마다 다시 연결합니다.
+    """
+    RECONNECT_DELAY = 5.0
+
+    def __init__(self, address):
+        self.address = address
+        self.writer = None
+        self.loop = None
+        self.task = None
+        self.sources = {}  # 스트림 id -> NodeAudioSource
+        self.ids = itertools.count(1)
+        self.node_stats = {}
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.writer is not None:
+            self.writer.close()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self.writer = await open_connection(self.address)
+                log.info("오디오 노드 연결됨: %s", self.address)
+                await self._read_loop(reader)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                log.warning("오디오 노드 연결 실패/끊김: %s", e)
+            finally:
+                if self.writer is not None:
+                    self.writer.close()
+                    self.writer = None
+                for source in list(self.sources.values()):
+                    source.end()
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    async def _read_loop(self, reader):
+        while True:
+            kind, stream_id, payload = await read_message(reader)
+            source = self.sources.get(stream_id)
+            if kind == AUDIO:
+                if source is not None:
+                    source.feed(payload)
+            elif kind == CONTROL:
+                if payload.get("op") == "event":
+                    if source is not None:
+                        source.on_event(payload)
+                elif payload.get("op") in ("ready", "stats"):
+                    self.node_stats = payload
+
+    def send(self, message):
+        if self.connected:
+            self.writer.write(pack_control(message, message.get("id", 0)))
+
+    def send_threadsafe(self, message):
+        """voice 스레드 등 이벤트 루프 밖에서 명령을 보낼 때 사용"""
+        self.loop.call_soon_threadsafe(self.send, message)
+
+class NodeAudioSource(discord.AudioSource):
+    """
+    오디오 노드가 만든 Opus 패킷을 재생하는 소스.
+    FFmpeg 실행, 볼륨 적용, Opus 인코딩은 모두 노드 프로세스에서 일어나고,
+    봇의 voice 스레드는 받은 패킷을 암호화해 전송하기만 합니다.
+    CREDIT_BATCH개를 재생할 때마다 노드에 credit을 돌려주어 노드가 앞서 보내는 양을 제한합니다.
+    """
+    def __init__(self, node, track, *, guild_id=None, volume=1.0, start=0.0, url=None, codec=None):
+        self.node = node
+        self.track = track
+        self.title = track.title
+        self.url = url or track.stream_url
+        self.video_url = track.video_url
+        self.thumbnail = track.thumbnail
+        self.id = next(node.ids)
+        self._volume = volume
+        self._start = start
+        self._frames = 0
+        self._consumed = 0
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._ended = False
+        self._discarding = False  # seek 후 노드의 seeked 이벤트 전까지 도착하는 이전 위치 패킷은 버림
+        self._closed = False
+        self.on_first_frame = None  # 노드의 첫 패킷을 읽을 때 voice 스레드에서 한 번 호출 (곡 전환 간격 측정용, 무음 제외)
+        node.sources[self.id] = self
+        node.send({"op": "play", "id": self.id, "guild": guild_id, "url": self.url, "codec": codec or track.codec,
+                   "volume": volume, "start": start})
+
+    @property
+    def elapsed(self):
+        return self._start + self._frames * FRAME_LENGTH
+
+    def feed(self, data):
+        with self._cond:
+            if not self._discarding:
+                self._buffer.append(data)
+                self._cond.notify_all()
+
+    def on_event(self, event):
+        if event["type"] == "seeked":
+            with self._cond:
+                self._discarding = False
+        elif event["type"] == "track_exception":
+            log.warning("오디오 노드 재생 오류 (%s): %s", self.title, event.get("error"))
+        elif event["type"] == "track_end":
+            self.end()
+
+    def end(self):
+        with self._cond:
+            self._ended = True
+            self._cond.notify_all()
+
+    def prime(self, frames=PREWARM_FRAMES, timeout=10.0):
+        """앞부분 패킷이 frames개 도착할 때까지 대기 (executor에서 호출)"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._buffer) >= frames or self._ended, timeout)
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        value = max(value, 0.0)
+        if value != self._volume:
+            self._volume = value
+            self.node.send_threadsafe({"op": "volume", "id": self.id, "value": value})
+
+    def seek(self, position):
+        with self._cond:
+            self._buffer.clear()
+            self._discarding = True
+            self._start, self._frames, self._consumed = position, 0, 0
+        self.node.send_threadsafe({"op": "seek", "id": self.id, "position": position})
+
+    def pause(self):
+        self.node.send_threadsafe({"op": "pause", "id": self.id})
+
+    def resume(self):
+        self.node.send_threadsafe({"op": "resume", "id": self.id})
+
+    def read(self):
+        with self._cond:
+            if not self._buffer and not self._ended:
+                self._cond.wait(FRAME_LENGTH)
+            if self._buffer:
+                data = self._buffer.popleft()
+            elif self._ended:
+                return b""
+            else:
+                return OPUS_SILENCE  # 패킷이 늦으면 끊지 않고 무음으로 채움
+            self._frames += 1
+            self._consumed += 1
+            grant = self._consumed >= CREDIT_BATCH
+            if grant:
+                self._consumed = 0
+            callback, self.on_first_frame = self.on_first_frame, None
+        if callback is not None:
+            callback()
+        if grant:
+            self.node.send_threadsafe({"op": "credit", "id": self.id, "frames": CREDIT_BATCH})
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.node.sources.pop(self.id, None)
+        if not self._ended:
+            self.node.send_threadsafe({"op": "stop", "id": self.id})
+
+audio_node_client = AudioNodeClient(AUDIO_NODE) if AUDIO_NODE else None
+
+class GuildQueue:
+    """
+    길드별 재생 대기열.
+    리스트 + 시작 오프셋 구조라 맨 앞 조회/꺼내기와 인덱스 접근이 O(1)이고,
+    남은 곡 수와 총 재생 시간을 누적 관리하므로 대기열 전체를 훑지 않고도 통계를 낼 수 있습니다.
+    version은 내용이 바뀔 때마다 증가하여 화면 캐시 무효화에 사용합니다.
+    """
+    COMPACT_THRESHOLD = 64  # 앞쪽에 비워 둔 칸이 이 수 이상이고 절반을 넘으면 리스트를 정리
+
+    def __init__(self, maxlen=MAX_QUEUE_LENGTH):
+        self.maxlen = maxlen
+        self._items = []
+        self._head = 0
+        self.total_duration = 0
+        self.version = 0
+        # 저널 차이 기록용 누적 카운터: 앞에서 꺼낸 곡 수, 맨 뒤에 추가한 곡 수, 그 외 순서가 바뀐 횟수
+        self.popped = 0
+        self.appended = 0
+        self.reordered = 0
+
+    def __len__(self):
+        return len(self._items) - self._head
+
+    def __iter__(self):
+        return itertools.islice(self._items, self._head, None)
+
+    def __getitem__(self, index):
+        return self._items[self._head + self._index(index)]
+
+    def _index(self, index, *, allow_end=False):
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size + allow_end:
+            raise IndexError("대기열 범위를 벗어난 번호")
+        return index
+
+    def _changed(self):
+        self.version += 1
+
+    def _compact(self):
+        if self._head >= self.COMPACT_THRESHOLD and self._head * 2 >= len(self._items):
+            del self._items[:self._head]
+            self._head = 0
+
+    def slice(self, start, stop):
+        """start~stop-1번째 항목 목록 (O(stop - start))"""
+        return self._items[self._head + max(start, 0):self._head + max(stop, 0)]
+
+    def peek(self):
+        return self._items[self._head] if len(self) else None
+
+    def put(self, track):
+        """곡을 맨 뒤에 추가. 대기열이 가득 찼으면 False"""
+        if len(self) >= self.maxlen:
+            return False
+        self._items.append(track)
+        self.total_duration += track.duration
+        self.appended += 1
+        self._changed()
+        return True
+
+    def extend(self, tracks):
+        return self.insert(len(self), tracks)
+
+    def insert(self, index, tracks):
+        """index 위치에 여러 곡을 한 번에 끼워 넣고, 실제로 추가된 곡 수를 반환 (최대 길이를 넘는 곡은 버림)"""
+        tracks = list(tracks)[:max(self.maxlen - len(self), 0)]
+        if not tracks:
+            return 0
+        position = self._head + self._index(index, allow_end=True)
+        if position == len(self._items):
+            self.appended += len(tracks)
+        else:
+            self.reordered += 1
+        self._items[position:position] = tracks
+        self.total_duration += sum(track.duration for track in tracks)
+        self._changed()
+        return len(tracks)
+
+    def get_nowait(self):
+        if not len(self):
+            raise IndexError("대기열이 비어 있음")
+        track = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        self.total_duration -= track.duration
+        self.popped += 1
+        self._compact()
+        self._changed()
+        return track
+
+    def remove(self, index):
+        track = self._items.pop(self._head + self._index(index))
+        self.total_duration -= track.duration
+        self.reordered += 1
+        self._changed()
+        return track
+
+    def move(self, index, new_index):
+        track = self._items.pop(self._head + self._index(index))
+        self._items.insert(self._head + self._index(new_index, allow_end=True), track)
+        self.reordered += 1
+        self._changed()
+        return track
+
+    def shuffle(self):
+        items = self._items[self._head:]
+        random.shuffle(items)
+        self._items = items
+        self._head = 0
+        self.reordered += 1
+        self._changed()
+
+    def clear(self):
+        self._items = []
+        self._head = 0
+        self.total_duration = 0
+        self.reordered += 1
+        self._changed()
+
+class QueuePageView(discord.ui.View):
+    """
+    대기열 페이지를 넘기는 ◀ ▶ 버튼.
+    nowplaying 메시지용(nowplaying=True)은 길드의 queue_page를 바꾸고 임베드를 다시 그리며,
+    /playlist 응답용은 자체 페이지 번호로 메시지 내용만 바꿉니다.
+    """
+
+    def __init__(self, cog, guild_id, *, nowplaying=False):
+        super().__init__(timeout=None if nowplaying else 180)
+        self.cog = cog
+        self.guild_id = guild_id
+        self.nowplaying = nowplaying
+        self.page = 0
+
+    def sync_buttons(self, player, page):
+        self.previous_page.disabled = page <= 0
+        self.next_page.disabled = page >= player.page_count - 1
+
+    async def turn(self, interaction: discord.Interaction, step):
+        player = self.cog.players.get(self.guild_id)
+        if player is None:
+            await interaction.response.defer()
+            return
+        if self.nowplaying:
+            player.queue_page = page = player.clamp_page(player.queue_page + step)
+            self.sync_buttons(player, page)
+            embed = await self.cog.nowplaying_logic(interaction)
+            if isinstance(embed, str):
+                await interaction.response.defer()
+                return
+            player.ui_digest = self.cog.render_digest(embed)
+            await interaction.response.edit_message(embed=embed, view=self)
+        else:
+            self.page = page = player.clamp_page(self.page + step)
+            self.sync_buttons(player, page)
+            await interaction.response.edit_message(content=self.cog.playlist_text(player, page), view=self)
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, -1)
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.turn(interaction, 1)
+
+class GuildPlayer:
+    """
+    길드 하나의 재생 상태.
+    길드별 dict 여러 개 대신 이 객체 하나에 모아 Music.players에 보관하며, 처음 필요할 때 생성되고 /stop 시 해제됩니다.
+    """
+    __slots__ = (
+        "guild_id",
+        "queue",               # 대기열
+        "current",             # 현재 재생 곡
+        "last_track",          # 마지막 재생 곡 (자동재생 여부 상관없이)
+        "reference_track",     # 사용자가 마지막으로 입력한(수동 추가한) 곡 기준
+        "autoplay_index",      # 자동재생 검색 인덱스 (초기값 2: 기준 곡 다음부터)
+        "state",               # 재생 상태 (STATE_IDLE / STATE_PLAYING)
+        "events",              # 재생 작업이 처리할 이벤트 큐 (이벤트, 데이터, 완료 future)
+        "task",                # 이벤트를 처리하는 길드 재생 작업
+        "interaction",         # 재생 작업이 사용할 가장 최근 interaction
+        "loop",                # 반복 여부
+        "volume",              # 볼륨 (%, None이면 기본값)
+        "nowplaying_message",  # nowplaying 메시지
+        "autoplay",            # 자동재생 ON/OFF (기본 ON)
+        "prefetched",          # 미리 추출한 관련 곡
+        "prefetch_key",        # prefetched/prefetch_task가 대상으로 하는 (기준 곡 video id, 믹스 순번)
+        "prefetch_task",       # 자동재생 곡 prefetch 작업
+        "ingest_task",         # 플레이리스트 백그라운드 추가 작업
+        "ingest_pending",      # 추가 작업 뒤에 이어서 추가할 플레이리스트 (interaction, 첫 묶음, 나머지 묶음 generator)
+        "refresh_task",        # 다음 곡 스트림 URL 사전 갱신 작업
+        "prewarm_task",        # 다음 곡 소스 사전 준비 작업
+        "prewarmed",           # 미리 열어 둔 다음 곡 (track, source)
+        "track_ended_at",      # 이전 곡 재생이 끝난 시각 (곡 전환 간격 측정용)
+        "idle_since",          # 유휴 상태가 시작된 시각 (monotonic, 활동 중이면 None)
+        "ui_task",             # 예약된 nowplaying 임베드 갱신 작업
+        "ui_interaction",      # 다음 갱신에 사용할 가장 최근 interaction
+        "ui_digest",           # 마지막으로 보낸 임베드 내용의 해시
+        "queue_page",          # nowplaying 임베드에 표시 중인 대기열 페이지
+        "queue_view",          # nowplaying 메시지의 페이지 버튼
+        "page_cache",          # 페이지 번호 -> 렌더링된 대기열 텍스트
+        "page_cache_version",  # page_cache를 만든 시점의 queue.version
+        "journal_state",       # 마지막으로 저널에 기록한 상태 (변경 감지용)
+        "journal_mark",        # 마지막 기록 시점의 대기열 카운터 (reordered, popped, appended)
+    )
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.queue = GuildQueue()
+        self.current = None
+        self.last_track = None
+        self.reference_track = None
+        self.autoplay_index = 2
+        self.state = STATE_IDLE
+        self.events = asyncio.Queue()
+        self.task = None
+        self.interaction = None
+        self.loop = False
+        self.volume = None
+        self.nowplaying_message = None
+        self.autoplay = True
+        self.prefetched = None
+        self.prefetch_key = None
+        self.prefetch_task = None
+        self.ingest_task = None
+        self.ingest_pending = deque()
+        self.refresh_task = None
+        self.prewarm_task = None
+        self.prewarmed = None
+        self.track_ended_at = None
+        self.idle_since = None
+        self.ui_task = None
+        self.ui_interaction = None
+        self.ui_digest = None
+        self.queue_page = 0
+        self.queue_view = None
+        self.page_cache = {}
+        self.page_cache_version = -1
+        self.journal_state = None
+        self.journal_mark = None
+
+    @property
+    def page_count(self):
+        return max((len(self.queue) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE, 1)
+
+    def clamp_page(self, page):
+        return min(max(page, 0), self.page_count - 1)
+
+    def render_queue_page(self, page):
+        """
+        대기열의 page번째 페이지 텍스트. 한 페이지 분량만 잘라서 만들고,
+        대기열이 바뀌기 전까지는 캐시된 텍스트를 그대로 재사용합니다.
+        """
+        if self.page_cache_version != self.queue.version:
+            self.page_cache.clear()
+            self.page_cache_version = self.queue.version
+        text = self.page_cache.get(page)
+        if text is None:
+            start = page * QUEUE_PAGE_SIZE
+            lines = []
+            for idx, track in enumerate(self.queue.slice(start, start + QUEUE_PAGE_SIZE), start + 1):
+                title = track.title
+                if len(title) > QUEUE_TITLE_LIMIT:
+                    title = title[:QUEUE_TITLE_LIMIT - 1] + "…"
+                lines.append(f"{idx}. {title}")
+            text = self.page_cache[page] = "\n".join(lines) if lines else "대기열이 비어 있습니다."
+        return text
+
+    def journal_fingerprint(self):
+        return (self.queue.version, self.current, self.reference_track, self.autoplay_index, self.autoplay, self.volume)
+
+    @staticmethod
+    def journal_track(track):
+        """스트림 URL은 재시작 후 만료됐을 수 있으므로 저장하지 않음"""
+        if track is None:
+            return None
+        return dict(track.to_record(), stream_url=None, codec=None, autoplay=track.autoplay)
+
+    def snapshot(self, queue=True):
+        """저널에 기록할 상태 (queue=False면 대기열 목록 제외)"""
+        snapshot = {
+            "guild": self.guild_id,
+            "saved_at": time.time(),
+            "current": self.journal_track(self.current),
+            "reference": self.journal_track(self.reference_track),
+            "autoplay_index": self.autoplay_index,
+            "autoplay": self.autoplay,
+            "volume": self.volume,
+        }
+        if queue:
+            snapshot["queue"] = [self.journal_track(track) for track in self.queue]
+        return snapshot
+
+    def journal_record(self, full=False):
+        """
+        저널에 덧붙일 기록. 마지막 기록 이후 대기열 변경이 앞쪽 곡 꺼내기와 맨 뒤 추가뿐이면
+        큰 대기열 전체를 다시 쓰지 않도록 그 차이만 기록하고, 그 외에는 전체 스냅샷을 기록합니다.
+        """
+        queue = self.queue
+        mark = (queue.reordered, queue.popped, queue.appended)
+        last, self.journal_mark = self.journal_mark, mark
+        appended = mark[2] - last[2] if last is not None else 0
+        # 꺼낸 곡 수가 이전 대기열 길이 이하일 때만(= 새로 추가한 곡이 아직 모두 남아 있을 때) 차이로 표현 가능
+        if full or last is None or last[0] != mark[0] or appended > len(queue):
+            return self.snapshot()
+        return dict(self.snapshot(queue=False), popped=mark[1] - last[1],
+                    appended=[self.journal_track(track) for track in queue.slice(len(queue) - appended, len(queue))])
+
+    def restore(self, snapshot):
+        """저널 스냅샷에서 대기열을 복원. 재생 중이던 곡은 대기열 맨 앞으로, 스트림 URL은 재생 직전에 다시 추출"""
+        records = snapshot["queue"]
+        if snapshot["current"] is not None:
+            records = [snapshot["current"]] + records
+        self.queue.extend(Track.from_record(record) for record in records)
+        if snapshot["reference"] is not None:
+            self.reference_track = Track.from_record(snapshot["reference"])
+        self.autoplay_index = snapshot["autoplay_index"]
+        self.autoplay = snapshot["autoplay"]
+        self.volume = snapshot["volume"]
+
+    def discard_prewarmed(self):
+        if self.prewarm_task is not None:
+            self.prewarm_task.cancel()
+            self.prewarm_task = None
+        if self.prewarmed is not None:
+            self.prewarmed[1].cleanup()
+            self.prewarmed = None
+
+    def release(self):
+        """재생 작업과 백그라운드 작업을 취소하고 미리 열어 둔 소스를 정리"""
+        for task in (self.task, self.ingest_task, self.prefetch_task, self.refresh_task, self.ui_task):
+            if task is not None:
+                task.cancel()
+        self.task = self.ingest_task = self.prefetch_task = self.refresh_task = self.ui_task = None
+        self.discard_prewarmed()
+        if self.queue_view is not None:
+            self.queue_view.stop()
+            self.queue_view = None
+
+    def memory_usage(self):
+        """이 길드 상태가 차지하는 대략적인 메모리 (바이트)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.queue) + sys.getsizeof(self.queue._items)
+        return size + sum(track.memory_usage() for track in self.queue)
 
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.queue = {}              # 서버별 대기열
-        self.current = {}            # 현재 재생 곡
-        self.last_track = {}         # 마지막 재생 곡 (자동재생 여부 상관없이)
-        self.reference_track = {}    # 사용자가 마지막으로 입력한(수동 추가한) 곡 기준
-        self.autoplay_index = {}     # 자동재생 검색 인덱스 (초기값 2: 기준 곡 다음부터)
-        self.is_playing = {}         # 재생 상태
-        self.loop = {}               # 반복 여부
-        self.volume = {}             # 볼륨
-        self.nowplaying_message = {} # nowplaying 메시지
-        self.autoplay = {}           # 자동재생 ON/OFF (기본 ON)
-        self.prefetched = {}         # 미리 추출한 관련 곡 캐시
-        self.prefetch_lock = {}      # prefetch 작업 동시 실행 방지를 위한 락
-    
-    async def reset_state(self, guild_id):
-        self.queue[guild_id] = asyncio.Queue()
-        self.current[guild_id] = None
-        self.last_track[guild_id] = None
-        self.reference_track[guild_id] = None
-        self.autoplay_index[guild_id] = 2
-        self.is_playing[guild_id] = False
-        self.loop[guild_id] = False
-        self.volume[guild_id] = 100
-        self.autoplay[guild_id] = True
-        self.prefetched[guild_id] = None
-        self.prefetch_lock[guild_id] = False
-        if guild_id in self.nowplaying_message:
-            del self.nowplaying_message[guild_id]
+        self.players = {}  # guild_id -> GuildPlayer
+        self.transition_gaps = deque(maxlen=256)  # 최근 곡 전환 간격 (초, 사전 준비 여부)
+        self.reaper_task = None
+        self.journal = None
+        self.audio_cache = None
+        self.journal_task = None
+        self.journal_deleted = set()  # 저널에 삭제 표시를 남길 길드
+        self.ui_stats = {"requested": 0, "coalesced": 0, "unchanged": 0, "edits": 0}
+        self.prefetch_stats = {"hit": 0, "miss": 0}  # 자동재생 시 미리 추출한 곡 사용 여부
+        self.metrics_runner = None
+
+    async def cog_load(self):
+        self.reaper_task = asyncio.create_task(self.reap_idle_guilds())
+        # 저널은 봇 프로세스에서만 열어야 하므로 import 시점이 아니라 여기서 생성
+        self.journal = await asyncio.get_running_loop().run_in_executor(None, QueueJournal, QUEUE_JOURNAL_PATH)
+        await asyncio.get_running_loop().run_in_executor(None, extraction_cache.open)
+        self.journal_task = asyncio.create_task(self.journal_queues())
+        if AUDIO_CACHE_DIR:
+            # 추출 워커 프로세스도 이 모듈을 import하므로 캐시는 봇 프로세스의 코그에서만 생성
+            self.audio_cache = AudioCache(AUDIO_CACHE_DIR)
+        if METRICS_PORT:
+            await self.start_metrics_server(METRICS_PORT)
+        if audio_node_client is not None:
+            audio_node_client.start()
+
+    async def cog_unload(self):
+        for task in (self.reaper_task, self.journal_task):
+            if task is not None:
+                task.cancel()
+        extraction_scheduler.shutdown()
+        await self.flush_journal()
+        extraction_cache.close()
+        if self.audio_cache is not None:
+            self.audio_cache.close()
+            self.audio_cache = None
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+            self.metrics_runner = None
+        if audio_node_client is not None:
+            await audio_node_client.close()
+
+    async def start_metrics_server(self, port):
+        """localhost:port/metrics 에서 Prometheus 텍스트 형식 지표를 제공"""
+        async def handle(request):
+            return web.Response(text="\n".join(self.render_metrics()) + "\n", content_type="text/plain", charset="utf-8")
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self.metrics_runner = web.AppRunner(app, access_log=None)
+        await self.metrics_runner.setup()
+        await web.TCPSite(self.metrics_runner, "127.0.0.1", port).start()
+        log.info("지표 엔드포인트: http://127.0.0.1:%d/metrics", port)
+
+    def render_metrics(self):
+        scheduler = extraction_scheduler.stats()
+        queue_lengths = [len(player.queue) for player in self.players.values()]
+        ffmpeg_running = sum(1 for source in list(ffmpeg_sources)
+                             if getattr(source, "_process", None) is not None and source._process.poll() is None)
+        transitions = self.transition_stats()
+        lines = extraction_latency.render()
+        lines += render_metric("musicbot_prefetch_total", "counter", "자동재생 시 미리 추출한 곡 적중/미적중 수",
+                               [({"result": result}, count) for result, count in self.prefetch_stats.items()])
+        lines += render_metric("musicbot_extraction_queue_depth", "gauge", "추출 대기 중인 작업 수",
+                               [({}, scheduler["queue_depth"])])
+        lines += render_metric("musicbot_extraction_running", "gauge", "실행 중인 추출 작업 수",
+                               [({}, scheduler["running"])])
+        lines += render_metric("musicbot_extraction_wait_seconds", "gauge", "추출 작업 대기 시간 (최근 평균/최대)",
+                               [({"stat": "avg"}, f"{scheduler['wait_avg']:.6f}"),
+                                ({"stat": "max"}, f"{scheduler['wait_max']:.6f}")])
+        lines += render_metric("musicbot_extraction_requests_total", "counter", "추출 요청 수 (shared: 진행 중인 추출에 합류)",
+                               [({"result": "started"}, extraction_flights.calls - extraction_flights.shared),
+                                ({"result": "shared"}, extraction_flights.shared)])
+        lines += render_metric("musicbot_search_cache_total", "counter", "검색어 캐시 적중/미적중 수",
+                               [({"result": "hit"}, search_cache.hits), ({"result": "miss"}, search_cache.misses)])
+        lines += render_metric("musicbot_extraction_cache_total", "counter", "추출 캐시 적중/미적중 수",
+                               [({"result": "hit"}, extraction_cache.hits), ({"result": "miss"}, extraction_cache.misses)])
+        if self.audio_cache is not None:
+            lines += render_metric("musicbot_audio_cache_total", "counter", "재생 시 오디오 캐시 적중/미적중 수",
+                                   [({"result": "hit"}, self.audio_cache.hits), ({"result": "miss"}, self.audio_cache.misses)])
+            lines += render_metric("musicbot_audio_cache_bytes", "gauge", "오디오 캐시 전체 크기",
+                                   [({}, self.audio_cache.total_size)])
+        lines += render_metric("musicbot_ffmpeg_processes", "gauge", "실행 중인 FFmpeg 프로세스 수", [({}, ffmpeg_running)])
+        if audio_node_client is not None:
+            lines += render_metric("musicbot_audio_node_streams", "gauge", "오디오 노드에서 재생 중인 스트림 수",
+                                   [({"connected": str(audio_node_client.connected).lower()}, len(audio_node_client.sources))])
+        lines += render_metric("musicbot_voice_connections", "gauge", "연결된 음성 채널 수",
+                               [({}, len(self.bot.voice_clients))])
+        lines += render_metric("musicbot_players", "gauge", "상태를 보유한 길드 수", [({}, len(self.players))])
+        lines += render_metric("musicbot_queue_tracks", "gauge", "전체 길드 대기열 곡 수 합계/최대",
+                               [({"stat": "sum"}, sum(queue_lengths)), ({"stat": "max"}, max(queue_lengths, default=0))])
+        lines += render_metric("musicbot_nowplaying_updates_total", "counter", "nowplaying 임베드 갱신 요청/수정/생략 수",
+                               [({"result": result}, count) for result, count in self.ui_stats.items()])
+        lines += render_metric("musicbot_transition_gap_seconds", "gauge", "최근 곡 전환 간격: 이전 곡 종료~다음 곡 첫 프레임 (평균/최대)",
+                               [({"stat": "avg"}, f"{transitions['gap_avg']:.6f}"),
+                                ({"stat": "max"}, f"{transitions['gap_max']:.6f}")])
+        return lines
+
+    def get_player(self, guild_id):
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = GuildPlayer(guild_id)
+            snapshot = self.journal.restore(guild_id) if self.journal is not None else None
+            if snapshot is not None:
+                player.restore(snapshot)
+                log.info("길드 %s 대기열 복원: %d곡", guild_id, len(player.queue))
+        return player
+
+    def release_player(self, guild_id):
+        player = self.players.pop(guild_id, None)
+        if player is not None:
+            player.release()
+            self.journal_deleted.add(guild_id)
+
+    async def journal_queues(self):
+        while True:
+            await asyncio.sleep(QUEUE_JOURNAL_INTERVAL)
+            try:
+                await self.flush_journal()
+            except Exception as e:
+                log.exception("대기열 저널 기록 오류: %s", e)
+
+    async def flush_journal(self):
+        """
+        마지막 기록 이후 상태가 바뀐 길드의 기록과 해제된 길드의 삭제 표시를 한 번에 덧붙여 기록.
+        파일이 커지면 대신 길드별 최신 스냅샷만 남기도록 다시 씀
+        """
+        journal = self.journal
+        if journal is None:
+            return
+        loop = asyncio.get_running_loop()
+        if journal.needs_compaction():
+            self.journal_deleted.clear()
+            live = list(journal.snapshots.values())
+            for player in self.players.values():
+                player.journal_state = player.journal_fingerprint()
+                live.append(player.journal_record(full=True))
+            await loop.run_in_executor(None, journal.compact, live)
+            return
+        records = [{"guild": guild_id, "deleted": True} for guild_id in self.journal_deleted if guild_id not in self.players]
+        self.journal_deleted.clear()
+        for player in self.players.values():
+            state = player.journal_fingerprint()
+            if state != player.journal_state:
+                player.journal_state = state
+                records.append(player.journal_record())
+        if records:
+            await loop.run_in_executor(None, journal.append, records)
+
+    async def shutdown_player(self, guild, description):
+        """nowplaying 메시지를 정지 상태로 바꾸고, 길드 상태를 해제한 뒤 음성 채널에서 나감"""
+        player = self.players.get(guild.id)
+        if player is not None and player.nowplaying_message is not None:
+            embed = discord.Embed(
+                title="■ 정지",
+                description=description,
+                color=discord.Color.dark_gray()
+            )
+            try:
+                await player.nowplaying_message.edit(content="", embed=embed, view=None)
+            except discord.HTTPException:
+                pass
+        self.release_player(guild.id)
+        if guild.voice_client:
+            await guild.voice_client.disconnect()
+
+    @staticmethod
+    def is_idle(voice_client):
+        """재생 중이 아니거나, 일시정지됐거나, 채널에 봇 말고 들을 사람이 없으면 유휴 상태"""
+        if voice_client is None or not voice_client.is_connected():
+            return True
+        if not voice_client.is_playing():
+            return True
+        return not any(not member.bot for member in voice_client.channel.members)
+
+    async def reap_idle_guilds(self):
+        """
+        IDLE_CHECK_INTERVAL마다 길드를 훑어, IDLE_TIMEOUT 이상 유휴 상태인 길드는
+        음성 연결을 끊고 prefetch/사전 준비 소스와 길드 상태를 해제합니다.
+        """
+        idle_since = {}  # 플레이어 없이 /join만 한 길드의 유휴 시작 시각
+        while True:
+            await asyncio.sleep(IDLE_CHECK_INTERVAL)
+            now = time.monotonic()
+            guilds = {voice_client.guild.id: voice_client.guild for voice_client in self.bot.voice_clients}
+            for guild_id in list(self.players):
+                guild = guilds.get(guild_id) or self.bot.get_guild(guild_id)
+                if guild is None:
+                    self.release_player(guild_id)
+                else:
+                    guilds[guild_id] = guild
+            for guild_id, guild in guilds.items():
+                player = self.players.get(guild_id)
+                if not self.is_idle(guild.voice_client):
+                    if player is not None:
+                        player.idle_since = None
+                    idle_since.pop(guild_id, None)
+                    continue
+                if player is not None:
+                    if player.idle_since is None:
+                        player.idle_since = now
+                    since = player.idle_since
+                else:
+                    since = idle_since.setdefault(guild_id, now)
+                if now - since < IDLE_TIMEOUT:
+                    continue
+                idle_since.pop(guild_id, None)
+                log.info("유휴 길드 정리: %s (%.0f초 유휴)", guild_id, now - since)
+                try:
+                    await self.shutdown_player(guild, "오랫동안 재생이 없어 음성 채널을 나갔어요.")
+                except Exception as e:
+                    log.exception("유휴 길드 정리 오류: %s", e)
+            for guild_id in list(idle_since):
+                if guild_id not in guilds:
+                    del idle_since[guild_id]
+
+    def memory_usage(self):
+        """길드 상태 전체의 대략적인 메모리 사용량"""
+        return {
+            "guilds": len(self.players),
+            "bytes": sum(player.memory_usage() for player in self.players.values()),
+        }
     
     async def update_UI(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
+        """
+        nowplaying 임베드 갱신을 예약합니다. UI_UPDATE_DELAY 안에 들어온 요청은
+        한 번의 메시지 수정으로 합쳐지고, 내용이 바뀌지 않았으면 수정하지 않습니다.
+        """
+        player = self.get_player(interaction.guild.id)
+        player.ui_interaction = interaction
+        self.ui_stats["requested"] += 1
+        if player.ui_task is not None and not player.ui_task.done():
+            self.ui_stats["coalesced"] += 1
+            return
+        player.ui_task = asyncio.create_task(self.flush_UI(player))
+
+    async def flush_UI(self, player):
+        await asyncio.sleep(UI_UPDATE_DELAY)
+        interaction = player.ui_interaction
         nowplaying_embed = await self.nowplaying_logic(interaction)
-        if guild_id in self.nowplaying_message:
+        if isinstance(nowplaying_embed, str):
+            content, nowplaying_embed = nowplaying_embed, None
+        else:
+            content = ""
+        digest = self.render_digest(nowplaying_embed or content)
+        if digest == player.ui_digest and player.nowplaying_message is not None:
+            self.ui_stats["unchanged"] += 1
+            return
+        if player.queue_view is None:
+            player.queue_view = QueuePageView(self, player.guild_id, nowplaying=True)
+        player.queue_view.sync_buttons(player, player.queue_page)
+        if player.nowplaying_message is not None:
             try:
-                await self.nowplaying_message[guild_id].edit(content="", embed=nowplaying_embed)
+                await player.nowplaying_message.edit(content=content, embed=nowplaying_embed, view=player.queue_view)
             except discord.NotFound:
-                self.nowplaying_message[guild_id] = await interaction.followup.send(embed=nowplaying_embed)
+                player.nowplaying_message = await interaction.followup.send(content, embed=nowplaying_embed,
+                                                                            view=player.queue_view)
         else:
-            self.nowplaying_message[guild_id] = await interaction.followup.send(embed=nowplaying_embed)
+            player.nowplaying_message = await interaction.followup.send(content, embed=nowplaying_embed,
+                                                                        view=player.queue_view)
+        player.ui_digest = digest
+        self.ui_stats["edits"] += 1
+
+    @staticmethod
+    def render_digest(rendered):
+        """임베드(또는 문자열) 내용의 해시. 바뀌지 않은 화면은 다시 보내지 않기 위해 사용"""
+        if isinstance(rendered, discord.Embed):
+            rendered = json.dumps(rendered.to_dict(), sort_keys=True)
+        return hash(rendered)
+
+    def ui_update_stats(self):
+        """nowplaying 갱신 요청 수, 실제 수정 수, 합치기/변경 없음으로 절약한 수정 수"""
+        stats = dict(self.ui_stats)
+        stats["saved"] = stats["coalesced"] + stats["unchanged"]
+        return stats
     
     async def join_logic(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
         if not interaction.user.voice or not interaction.user.voice.channel:
             return "🚫 음성 채널에 연결되어 있지 않습니다!"
         channel = interaction.user.voice.channel
@@ -175,19 +2249,22 @@ class Music(commands.Cog):
             return f"✅ `{channel.name}` 채널에 입장했습니다!"
     
     @app_commands.command(name="join", description="Join 종이봇 in voice channel")
+    @traced("join")
     async def join(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        result = await self.join_logic(interaction)
+        with trace_stage("voice_connect"):
+            result = await self.join_logic(interaction)
         await interaction.followup.send(result, ephemeral=True)
     
     @app_commands.command(name="pplay", description="Play song or playlist")
     @app_commands.describe(url="Put link or name of song here")
+    @traced("pplay")
     async def play(self, interaction: discord.Interaction, url: str):
         guild_id = interaction.guild.id
-        if guild_id not in self.queue:
-            self.queue[guild_id] = asyncio.Queue()
-        print("[DEBUG] /pplay 명령어 실행됨")
-        join_result = await self.join_logic(interaction)
+        player = self.get_player(guild_id)
+        log.debug("/pplay 명령어 실행됨: %s", url)
+        with trace_stage("voice_connect"):
+            join_result = await self.join_logic(interaction)
         if "🚫" in join_result:
             await interaction.response.send_message(join_result, ephemeral=True)
             return
@@ -206,132 +2283,419 @@ class Music(commands.Cog):
         
         asyncio.create_task(delete_ephemeral())
 
-        if guild_id not in self.nowplaying_message:
+        if player.nowplaying_message is None:
             channel = interaction.channel
-            persistent_msg = await channel.send("로딩 중 ⏳")
-            self.nowplaying_message[guild_id] = persistent_msg
+            with trace_stage("ui_update"):
+                persistent_msg = await channel.send("로딩 중 ⏳")
+            player.nowplaying_message = persistent_msg
+            player.ui_digest = None
         
         # await interaction.response.defer()
         voice_client = interaction.guild.voice_client
         if not voice_client or not voice_client.is_connected():
             await interaction.followup.send("❌ 봇이 음성 채널에 연결되지 못했습니다.", ephemeral=True)
             return
+        remaining_chunks = None
+        is_playlist = YTDLSource.is_playlist_url(url)
         try:
-            tracks = await YTDLSource.from_url(url, loop=self.bot.loop, stream=True)
+            with trace_stage("extraction"):
+                if is_playlist:
+                    tracks, remaining_chunks = await YTDLSource.from_playlist_url(url, guild_id=guild_id)
+                else:
+                    tracks = await YTDLSource.from_url(url, stream=True, guild_id=guild_id)
             if not tracks:
                 await interaction.followup.send("❌ 노래를 가져오는 데 문제가 발생했습니다. URL을 확인해주세요.", ephemeral=True)
                 return
         except Exception as e:
             await interaction.followup.send(f"❌ 노래를 불러오는 중 오류 발생: {e}", ephemeral=True)
             return
-        for track in tracks:
-            print(f"[DEBUG] 대기열에 추가되는 트랙: {track.title}")
-            await self.queue[guild_id].put(track)
+        if is_playlist and player.ingest_task is not None and not player.ingest_task.done():
+            # 이전 플레이리스트를 아직 추가하는 중이면 취소하지 않고, 그 뒤에 이 플레이리스트 전체를 순서대로 추가
+            player.ingest_pending.append((interaction, tracks, remaining_chunks))
+            await interaction.followup.send("⏳ 이전 플레이리스트를 추가하는 중이라, 끝나는 대로 이어서 추가합니다.", ephemeral=True)
+            return
+        if log.isEnabledFor(logging.DEBUG):
+            for track in tracks:
+                log.debug("대기열에 추가되는 트랙: %s", track.title)
+        with trace_stage("queueing"):
+            added = player.queue.extend(tracks)
+        if added < len(tracks):
+            await interaction.followup.send(f"⚠️ 대기열이 가득 차서 {added}곡만 추가했습니다. (최대 {player.queue.maxlen}곡)", ephemeral=True)
+            if remaining_chunks is not None:
+                await remaining_chunks.aclose()
+                remaining_chunks = None
         # 사용자가 직접 추가한 마지막 곡을 기준(reference_track)으로 저장
-        self.reference_track[guild_id] = tracks[-1]
-        self.autoplay_index[guild_id] = 2
-        if not self.is_playing.get(guild_id, False) and not voice_client.is_paused():
-            await self.play_next(interaction)
-        else:
-            await self.update_UI(interaction)
-        if self.queue[guild_id].qsize() >= 1:
+        player.reference_track = tracks[-1]
+        player.autoplay_index = 2
+        if remaining_chunks is not None:
+            player.ingest_task = asyncio.create_task(self.ingest_playlist(interaction, player, remaining_chunks))
+        # 재생 중이 아니면 재생 작업이 다음 곡을 시작하고, 재생 중이면 nowplaying만 갱신
+        with trace_stage("playback_start"):
+            await self.dispatch(player, ENQUEUE, interaction=interaction)
+        if len(player.queue) >= 1:
             try:
                 asyncio.create_task(interaction.delete_original_response())
             except discord.NotFound:
                 pass
     
-    async def prefetch_related(self, guild_id, ref_track):
+    async def ingest_playlist(self, interaction: discord.Interaction, player, chunks):
+        """
+        플레이리스트의 나머지 항목을 백그라운드에서 대기열에 추가하고,
+        묶음이 도착할 때마다 nowplaying 임베드를 갱신합니다.
+        추가하는 동안 요청된 플레이리스트(player.ingest_pending)는 끝난 뒤 요청 순서대로 이어서 추가하고,
+        대기열이 가득 차면 남은 플레이리스트까지 모두 중단합니다.
+        """
+        try:
+            while chunks is not None:
+                full = False
+                try:
+                    async for tracks in chunks:
+                        added = player.queue.extend(tracks)
+                        player.reference_track = tracks[-1]
+                        player.autoplay_index = 2
+                        log.debug("플레이리스트 항목 %d개 추가됨 - 대기열 크기: %d", added, len(player.queue))
+                        self.dispatch(player, ENQUEUE, interaction=interaction)
+                        if added < len(tracks):
+                            log.info("대기열이 가득 차서 플레이리스트 추가 중단 (최대 %d곡)", player.queue.maxlen)
+                            full = True
+                            break
+                finally:
+                    await chunks.aclose()
+                if full or not player.ingest_pending:
+                    break
+                interaction, first_chunk, remaining = player.ingest_pending.popleft()
+                chunks = YTDLSource.chain_chunks(first_chunk, remaining)
+        finally:
+            while player.ingest_pending:
+                _, _, remaining = player.ingest_pending.popleft()
+                if remaining is not None:
+                    await remaining.aclose()
+            if player.ingest_task is asyncio.current_task():
+                player.ingest_task = None
+    
+    def schedule_prefetch(self, player):
+        """
+        기준 곡 믹스의 autoplay_index번째 곡을 미리 추출합니다.
+        기준 곡이나 순번이 바뀌었으면 이전 기준으로 진행 중이거나 끝난 prefetch는 취소하고 버립니다.
+        """
+        if player.reference_track is None:
+            return
+        key = (player.reference_track.id, player.autoplay_index)
+        if player.prefetch_key != key:
+            if player.prefetch_task is not None:
+                player.prefetch_task.cancel()
+                player.prefetch_task = None
+            player.prefetched = None
+            player.prefetch_key = key
+        if player.prefetched is None and (player.prefetch_task is None or player.prefetch_task.done()):
+            player.prefetch_task = asyncio.create_task(self.prefetch_related(player, player.reference_track, player.autoplay_index))
+
+    async def prefetch_related(self, player, ref_track, index):
         """
         백그라운드에서 관련 곡을 prefetch할 때,
         사용자가 마지막으로 입력한 곡(ref_track)을 기준으로,
-        self.autoplay_index 값을 이용해 단 1개만 조회합니다.
+        믹스의 index번째 곡 단 1개만 조회합니다.
         """
-        if self.prefetch_lock.get(guild_id, False):
-            return
-        self.prefetch_lock[guild_id] = True
-        print(f"[DEBUG] 자동재생 검색 기준 곡: {ref_track.title}")
-        video_id = ref_track.video_url.split("watch?v=")[-1]
-        mix_url = YTDLSource.get_youtube_mix_link(video_id)
+        log.debug("자동재생 검색 기준 곡: %s", ref_track.title)
+        mix_url = YTDLSource.get_youtube_mix_link(ref_track.id)
         try:
-            index = self.autoplay_index.get(guild_id, 2)
-            tracks = await YTDLSource.from_mix_url(mix_url, loop=self.bot.loop, stream=True, playliststart=index)
+            tracks = await YTDLSource.from_mix_url(mix_url, stream=True, playliststart=index,
+                                                   guild_id=player.guild_id, priority=PRIORITY_PREFETCH)
             chosen_track = tracks[0] if tracks else None
-            self.prefetched[guild_id] = chosen_track
-            if chosen_track:
-                print(f"[DEBUG] Prefetched track for guild {guild_id} at index {index}: {chosen_track.title}")
-            else:
-                print(f"[DEBUG] Prefetched track for guild {guild_id} at index {index}: None")
+            if player.prefetch_key != (ref_track.id, index):
+                return  # 추출하는 동안 기준 곡/순번이 바뀜
+            player.prefetched = chosen_track
+            log.debug("Prefetched track for guild %s at index %d: %s", player.guild_id, index,
+                      chosen_track.title if chosen_track else None)
         except Exception as e:
-            print(f"[DEBUG] Prefetch 관련 오류: {e}")
-            self.prefetched[guild_id] = None
-        self.prefetch_lock[guild_id] = False
+            log.warning("Prefetch 관련 오류: %s", e)
+            player.prefetched = None
     
-    async def play_next(self, interaction: discord.Interaction, last_track=None):
-        guild_id = interaction.guild.id
-        voice_client = interaction.guild.voice_client
-        if not voice_client or not voice_client.is_connected():
-            print("[DEBUG] 봇이 이미 채널에서 나갔으므로, update_UI를 호출하지 않고 종료")
+    def is_playable(self, track, at=None):
+        """스트림 URL이 at 시점까지 유효하거나 오디오 캐시에 파일이 있으면 다시 추출하지 않고 재생 가능"""
+        return track.is_stream_fresh(at=at) or (self.audio_cache is not None and self.audio_cache.lookup(track.id) is not None)
+
+    def create_source(self, player, track):
+        """길드 볼륨 설정을 반영해 재생 모드에 맞는 오디오 소스를 생성"""
+        volume = player.volume
+        url, codec = (self.audio_cache.lookup(track.id) if self.audio_cache is not None else None) or (None, None)
+        # Opus 경로(노드/패스스루)는 볼륨을 지정하지 않으면 원본 음량(100%)으로 패킷을 그대로 복사해 트랜스코딩을 피함
+        # (PCM 경로의 기본값 50%보다 크게 들림, README 참고)
+        opus_volume = volume / 100 if volume is not None else 1.0
+        if audio_node_client is not None and audio_node_client.connected:
+            return NodeAudioSource(audio_node_client, track, guild_id=player.guild_id, url=url, codec=codec, volume=opus_volume)
+        if AUDIO_PASSTHROUGH:
+            return OpusPassthroughSource(track, url=url, codec=codec, volume=opus_volume)
+        if volume is None:
+            return YTDLSource.from_track(track, url=url)
+        return YTDLSource.from_track(track, volume=volume / 100, url=url)
+
+    def take_prewarmed(self, player, track):
+        """track용으로 미리 준비한 소스가 있으면 현재 볼륨을 반영해 반환, 다른 곡용이면 정리"""
+        warmed, player.prewarmed = player.prewarmed, None
+        if warmed is None:
+            return None
+        warmed_track, source = warmed
+        if warmed_track is not track:
+            source.cleanup()
+            return None
+        if player.volume is not None and source.volume != player.volume / 100:
+            if isinstance(source, OpusPassthroughSource):
+                # 패스스루는 볼륨을 바꾸려면 FFmpeg를 다시 열어야 하므로 미리 준비한 소스를 버리고 새로 생성
+                source.cleanup()
+                return None
+            source.volume = player.volume / 100
+        return source
+
+    async def prewarm_next(self, player, voice_client, source):
+        """
+        현재 곡이 PREWARM_LEAD초 남았을 때 다음 곡(대기열 맨 앞 또는 prefetch된 자동재생 곡)의
+        스트림을 미리 열고 앞부분 프레임을 버퍼링해 두어, 곡 전환 시 FFmpeg 실행/연결/프로브 시간을 없앱니다.
+        """
+        loop = asyncio.get_running_loop()
+        duration = source.track.duration
+        if not duration:
             return
-        
-        print(f"[DEBUG] play_next 호출됨 - 대기열 크기: {self.queue[guild_id].qsize()}")
-        if not self.queue[guild_id].empty():
-            self.current[guild_id] = await self.queue[guild_id].get()
-            self.is_playing[guild_id] = True
-            print(f"[DEBUG] 재생 중: {self.current[guild_id].title}")
-            # 기준 곡은 항상 현재 재생된 곡으로 갱신 (수동 곡일 경우에만 업데이트)
-            if not self.current[guild_id].data.get("autoplay"):
-                self.reference_track[guild_id] = self.current[guild_id]
-                self.autoplay_index[guild_id] = 2
-            asyncio.create_task(self.prefetch_related(guild_id, self.reference_track[guild_id]))
-            interaction.guild.voice_client.play(
-                self.current[guild_id],
-                after=lambda e: self.bot.loop.create_task(self.play_next_after(interaction, e))
-            )
-            await self.update_UI(interaction)
-        elif self.autoplay.get(guild_id, True) and self.reference_track.get(guild_id):
-            ref_track = self.reference_track[guild_id]
-            if self.prefetched.get(guild_id) is not None:
-                chosen_track = self.prefetched[guild_id]
-                chosen_track.data['autoplay'] = True
-                print(f"[DEBUG] Using prefetched track: {chosen_track.title}")
-                await self.queue[guild_id].put(chosen_track)
-                self.prefetched[guild_id] = None
-                self.autoplay_index[guild_id] += 1
-                asyncio.create_task(self.prefetch_related(guild_id, ref_track))
-                await self.play_next(interaction)
+        # 일시정지 중에는 elapsed가 늘지 않으므로 경과 시간 기준으로 대기
+        while voice_client.is_connected() and voice_client.source is source:
+            remaining = duration - source.elapsed
+            if remaining <= PREWARM_LEAD:
+                break
+            await asyncio.sleep(min(remaining - PREWARM_LEAD, 5.0))
+        while voice_client.is_connected() and voice_client.source is source:
+            if player.queue:
+                candidate = player.queue.peek()
+            elif player.autoplay:
+                candidate = player.prefetched
             else:
-                print(f"[DEBUG] 캐시에 프리패치된 트랙이 없음, 직접 추출 시도 (기준 곡: {ref_track.title})")
-                video_id = ref_track.video_url.split("watch?v=")[-1]
-                mix_url = YTDLSource.get_youtube_mix_link(video_id)
+                return
+            if candidate is not None:
+                break
+            await asyncio.sleep(0.5)  # prefetch가 아직 끝나지 않음
+        else:
+            return
+        if not self.is_playable(candidate) and not await YTDLSource.resolve(candidate, guild_id=player.guild_id,
+                                                                            priority=PRIORITY_PREFETCH):
+            return
+        next_source = self.create_source(player, candidate)
+        try:
+            await loop.run_in_executor(None, next_source.prime)
+        except asyncio.CancelledError:
+            next_source.cleanup()
+            raise
+        except Exception as e:
+            log.warning("다음 곡 사전 준비 실패: %s", e)
+            next_source.cleanup()
+            return
+        log.debug("다음 곡 사전 준비 완료: %s", candidate.title)
+        if player.prewarmed is not None:
+            player.prewarmed[1].cleanup()
+        player.prewarmed = (candidate, next_source)
+
+    def record_transition(self, ended_at, prewarmed):
+        """새 곡의 첫 프레임을 읽을 때 voice 스레드에서 호출: 이전 곡 종료부터의 간격을 기록"""
+        gap = time.perf_counter() - ended_at
+        self.transition_gaps.append((gap, prewarmed))
+        log.debug("곡 전환 간격: %.3f초 (%s)", gap, "사전 준비됨" if prewarmed else "사전 준비 없음")
+
+    def transition_stats(self):
+        """최근 곡 전환 간격 통계 (초)"""
+        gaps = [gap for gap, _ in self.transition_gaps]
+        return {
+            "count": len(gaps),
+            "gap_avg": sum(gaps) / len(gaps) if gaps else 0.0,
+            "gap_max": max(gaps, default=0.0),
+            "prewarmed_ratio": sum(1 for _, warmed in self.transition_gaps if warmed) / len(gaps) if gaps else 0.0,
+        }
+
+    def schedule_refresh(self, player):
+        if player.refresh_task is None or player.refresh_task.done():
+            player.refresh_task = asyncio.create_task(self.refresh_upcoming(player))
+
+    async def refresh_upcoming(self, player):
+        """
+        대기열 앞쪽 곡들의 예상 재생 시작 시각을 계산해,
+        그때까지 스트림 URL이 만료될 곡을 백그라운드에서 미리 다시 추출합니다.
+        """
+        start_at = time.time() + (player.current.duration if player.current else 0)
+        upcoming = player.queue.slice(0, REFRESH_LOOKAHEAD)
+        if not upcoming and player.prefetched is not None:
+            upcoming = [player.prefetched]
+        for track in upcoming:
+            if not self.is_playable(track, at=start_at):
+                log.debug("스트림 URL 사전 갱신: %s", track.title)
+                await YTDLSource.resolve(track, at=start_at, guild_id=player.guild_id, priority=PRIORITY_PREFETCH)
+            start_at += track.duration
+
+    def dispatch(self, player, event, data=None, *, interaction=None):
+        """
+        길드 재생 작업에 이벤트를 보내고, 처리가 끝나면 완료되는 future를 반환합니다.
+        재생 작업이 없으면 새로 시작하며, 이미 해제된 길드의 이벤트는 무시합니다.
+        """
+        done = asyncio.get_running_loop().create_future()
+        if self.players.get(player.guild_id) is not player:
+            done.set_result(None)
+            return done
+        if interaction is not None:
+            player.interaction = interaction
+        player.events.put_nowait((event, data, done))
+        if player.task is None or player.task.done():
+            player.task = asyncio.create_task(self.run_player(player))
+        return done
+
+    async def run_player(self, player):
+        """
+        길드마다 하나씩 실행되는 재생 작업. 이벤트를 하나씩 순서대로 처리하므로
+        곡 전환이 동시에 두 번 시작되거나 같은 자동재생 곡을 중복 추출하는 일이 없습니다.
+          IDLE    --ENQUEUE-->   다음 곡 시작 (곡이 없으면 IDLE 유지)
+          PLAYING --TRACK_END--> 다음 곡 시작
+          PLAYING --ENQUEUE-->   nowplaying 갱신
+          PLAYING --SKIP-->      현재 곡 정지 (이어서 TRACK_END가 옴)
+        /stop과 유휴 정리는 진행 중인 추출을 기다리지 않도록 release()에서 이 작업을 취소합니다.
+        """
+        try:
+            while True:
+                event, data, done = await player.events.get()
                 try:
-                    index = self.autoplay_index.get(guild_id, 2)
-                    tracks = await YTDLSource.from_mix_url(mix_url, loop=self.bot.loop, stream=True, playliststart=index)
-                    chosen_track = tracks[0] if tracks else None
-                    if chosen_track:
-                        chosen_track.data['autoplay'] = True
-                        print(f"[DEBUG] 선택된 관련 트랙: {chosen_track.title}")
-                        await self.queue[guild_id].put(chosen_track)
-                        self.autoplay_index[guild_id] = index + 1
-                        await self.play_next(interaction)
-                    else:
-                        print("[DEBUG] 관련 트랙을 찾지 못함")
-                        await self.update_UI(interaction)
+                    await self.handle_player_event(player, event, data)
                 except Exception as e:
-                    print(f"[DEBUG] Autoplay 오류: {e}")
+                    log.exception("재생 이벤트 처리 오류 (%s): %s", event, e)
+                finally:
+                    if not done.done():
+                        done.set_result(None)
+        finally:
+            while not player.events.empty():
+                _, _, done = player.events.get_nowait()
+                if not done.done():
+                    done.set_result(None)
+
+    async def handle_player_event(self, player, event, data):
+        log.debug("재생 이벤트: %s (상태: %s, 대기열 %d곡)", event, player.state, len(player.queue))
+        if event == TRACK_END:
+            if player.state != STATE_PLAYING or data is not player.current:
+                return  # 이미 처리한 곡의 종료 알림
+            player.state = STATE_IDLE
+            player.current = None
+            await self.start_next(player)
+        elif event == ENQUEUE:
+            if player.state == STATE_IDLE:
+                await self.start_next(player)
+            else:
+                await self.update_UI(player.interaction)
+        elif event == SKIP:
+            voice_client = player.interaction.guild.voice_client
+            if player.state == STATE_PLAYING and data is player.current and voice_client is not None:
+                voice_client.stop()
+
+    async def start_next(self, player):
+        """
+        대기열 맨 앞 곡(비어 있으면 자동재생 곡)을 재생합니다. 재생할 수 없는 곡은 건너뛰고 다음 곡을 시도하며,
+        play()가 성공한 뒤에만 STATE_PLAYING으로 바꾸고, 재생할 곡이 없거나 시작에 계속 실패하면 STATE_IDLE로 둡니다.
+        """
+        interaction = player.interaction
+        failures = 0
+        while True:
+            voice_client = interaction.guild.voice_client
+            if not voice_client or not voice_client.is_connected():
+                log.debug("봇이 이미 채널에서 나갔으므로, update_UI를 호출하지 않고 종료")
+                return
+            if not player.queue and not await self.enqueue_autoplay(player):
+                await self.update_UI(interaction)
+                return
+            track = player.queue.get_nowait()
+            source = self.take_prewarmed(player, track)
+            # 대기 중 만료됐거나(flat 항목은 처음부터) 스트림 URL이 없으면 재생 직전에 다시 추출
+            if source is None and not self.is_playable(track) and not await YTDLSource.resolve(track, guild_id=player.guild_id):
+                log.info("재생할 수 없는 곡 건너뜀: %s", track.title)
+                continue
+            if not voice_client.is_connected():
+                if source is not None:
+                    source.cleanup()
+                return
+            prewarmed = source is not None
+            try:
+                if source is None:
+                    # 재생 직전에만 FFmpeg 프로세스를 생성
+                    source = self.create_source(player, track)
+                # 간격은 이전 곡이 끝난 뒤 새 소스가 실제 첫 프레임을 내기까지 (FFmpeg 연결/프로브/첫 읽기 포함)
+                ended_at = player.track_ended_at
+                if ended_at is not None:
+                    source.on_first_frame = lambda: self.record_transition(ended_at, prewarmed)
+                voice_client.play(source, after=lambda e: self.after_playback(player, track, e))
+            except Exception as e:
+                # play()가 실패하면 after 콜백(TRACK_END)이 오지 않으므로 PLAYING으로 바꾸지 않고 다음 곡으로 넘어감
+                log.error("재생 시작 실패 (%s): %s", track.title, e)
+                if source is not None:
+                    source.cleanup()
+                failures += 1
+                if failures >= MAX_START_FAILURES:
+                    log.error("재생 시작이 %d번 연달아 실패하여 재생을 멈춤", failures)
                     await self.update_UI(interaction)
+                    return
+                continue
+            break
+        player.track_ended_at = None
+        player.current = track
+        player.state = STATE_PLAYING
+        log.debug("재생 중: %s", track.title)
+        if self.audio_cache is not None:
+            self.audio_cache.record_play(track)
+        # 기준 곡은 항상 현재 재생된 곡으로 갱신 (수동 곡일 경우에만 업데이트)
+        if not track.autoplay:
+            player.reference_track = track
+            player.autoplay_index = 2
+        self.schedule_prefetch(player)
+        self.schedule_refresh(player)
+        if player.prewarm_task is not None:
+            player.prewarm_task.cancel()
+        player.prewarm_task = asyncio.create_task(self.prewarm_next(player, voice_client, source))
+        await self.update_UI(interaction)
+
+    async def enqueue_autoplay(self, player):
+        """대기열이 비었을 때 기준 곡의 믹스에서 다음 자동재생 곡 1개를 대기열에 추가. 추가했으면 True"""
+        ref_track = player.reference_track
+        if not player.autoplay or ref_track is None:
+            return False
+        if player.prefetched is not None and player.prefetch_key != (ref_track.id, player.autoplay_index):
+            player.prefetched = None  # 이전 기준 곡/순번으로 가져온 곡
+        if player.prefetched is not None:
+            self.prefetch_stats["hit"] += 1
+            chosen_track, player.prefetched = player.prefetched, None
+            log.debug("Using prefetched track: %s", chosen_track.title)
+            index = player.autoplay_index
         else:
-            await self.update_UI(interaction)
+            self.prefetch_stats["miss"] += 1
+            log.debug("캐시에 프리패치된 트랙이 없음, 직접 추출 시도 (기준 곡: %s)", ref_track.title)
+            mix_url = YTDLSource.get_youtube_mix_link(ref_track.id)
+            index = player.autoplay_index
+            # 진행 중인 prefetch는 같은 곡을 조회하므로, 직접 추출이 그 추출에 합류해 우선순위를 올리고
+            # prefetch 결과는 이미 쓴 곡이 되므로 버림
+            if player.prefetch_task is not None:
+                player.prefetch_task.cancel()
+                player.prefetch_task = None
+            try:
+                tracks = await YTDLSource.from_mix_url(mix_url, stream=True, playliststart=index, guild_id=player.guild_id)
+            except Exception as e:
+                log.warning("Autoplay 오류: %s", e)
+                return False
+            chosen_track = tracks[0] if tracks else None
+            if chosen_track is None:
+                log.info("관련 트랙을 찾지 못함")
+                return False
+            log.debug("선택된 관련 트랙: %s", chosen_track.title)
+        chosen_track.autoplay = True
+        player.queue.put(chosen_track)
+        player.autoplay_index = index + 1
+        return True
     
-    async def play_next_after(self, interaction: discord.Interaction, error):
-        guild_id = interaction.guild.id
+    def after_playback(self, player, track, error):
+        """voice 스레드에서 호출되는 after 콜백: 종료 시각을 기록하고 재생 작업에 TRACK_END를 보냄"""
         if error:
-            print(f"[DEBUG] 오류: {error}")
-        self.is_playing[guild_id] = False
-        self.current[guild_id] = None
-        await self.play_next(interaction)
+            log.error("재생 오류: %s", error)
+        player.track_ended_at = time.perf_counter()
+        self.bot.loop.call_soon_threadsafe(self.dispatch, player, TRACK_END, track)
     
     async def nowplaying_logic(self, interaction: discord.Interaction):
-        guild_id = interaction.guild.id
         if not interaction.guild.voice_client or not interaction.guild.voice_client.is_playing():
             embed = discord.Embed(
                 title="■ 정지",
@@ -339,58 +2703,73 @@ class Music(commands.Cog):
                 color=discord.Color.dark_gray()
             )
             return embed
-        player = self.current.get(guild_id)
-        if not player:
+        player = self.players.get(interaction.guild.id)
+        current = player.current if player else None
+        if not current:
             return "❌ 현재 곡 정보를 가져올 수 없습니다."
-        if not self.queue[guild_id].empty():
-            queue_titles = "\n".join([f"{idx+1}. {track.title}" for idx, track in enumerate(list(self.queue[guild_id]._queue))])
+        guild_queue = player.queue
+        player.queue_page = page = player.clamp_page(player.queue_page)
+        queue_titles = player.render_queue_page(page)
+        if guild_queue:
+            queue_header = f"**대기열:** {len(guild_queue)}곡 · ⏳ `{datetime.timedelta(seconds=guild_queue.total_duration)}`"
+            if player.page_count > 1:
+                queue_header += f" · 📄 {page + 1}/{player.page_count}"
         else:
-            queue_titles = "대기열이 비어 있습니다."
-        title_text = "🎵 현재 자동 재생 중" if player.data.get("autoplay") else "🎵 현재 재생 중"
+            queue_header = "**대기열:**"
+        title_text = "🎵 현재 자동 재생 중" if current.autoplay else "🎵 현재 재생 중"
         embed = discord.Embed(
             title=title_text,
-            description=f"**[{player.title}]({player.video_url})**\n\n**대기열:**\n{queue_titles}",
+            description=f"**[{current.title}]({current.video_url})**\n\n{queue_header}\n{queue_titles}",
             color=discord.Color.blue()
         )
-        embed.set_thumbnail(url=player.thumbnail)
-        embed.add_field(name="노래 길이", value=f"⏳ `{str(datetime.timedelta(seconds=player.data.get('duration', 0)))}`", inline=True)
+        embed.set_thumbnail(url=current.thumbnail)
+        embed.add_field(name="노래 길이", value=f"⏳ `{str(datetime.timedelta(seconds=current.duration))}`", inline=True)
         embed.add_field(name="채널명", value=f"🔊 `{interaction.guild.voice_client.channel.name}`", inline=True)
-        embed.add_field(name="재생 방식", value="자동 재생" if player.data.get("autoplay") else "수동 추가", inline=True)
-        embed.set_footer(text="음악봇 - 디스코드 뮤직 플레이어", icon_url=player.thumbnail)
+        embed.add_field(name="재생 방식", value="자동 재생" if current.autoplay else "수동 추가", inline=True)
+        embed.set_footer(text="음악봇 - 디스코드 뮤직 플레이어", icon_url=current.thumbnail)
         return embed
     
     @app_commands.command(name="nowplaying", description="Show current playing song")
+    @traced("nowplaying")
     async def nowplaying(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        result = await self.nowplaying_logic(interaction)
-        if isinstance(result, str):
-            await interaction.followup.send(result, ephemeral=True)
-        else:
-            await interaction.followup.send(embed=result)
+        with trace_stage("ui_update"):
+            result = await self.nowplaying_logic(interaction)
+            if isinstance(result, str):
+                await interaction.followup.send(result, ephemeral=True)
+            else:
+                await interaction.followup.send(embed=result)
     
     @app_commands.command(name="skip", description="Skip current song")
+    @traced("skip")
     async def skip(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        guild_id = interaction.guild.id
         voice_client = interaction.guild.voice_client
-        if voice_client and voice_client.is_playing():
-            print("[DEBUG] /skip 호출됨")
-            voice_client.stop()
+        player = self.players.get(interaction.guild.id)
+        if voice_client and voice_client.is_playing() and player is not None:
+            log.debug("/skip 호출됨")
+            await self.dispatch(player, SKIP, player.current, interaction=interaction)
             await interaction.followup.send("⏭️ 노래 건너뜀", ephemeral=True)
         else:
             await interaction.followup.send("❌ 재생 중인 곡 없음", ephemeral=True)
     
     @app_commands.command(name="volume", description="Adjust the volume")
     @app_commands.describe(volume="Set volume (0-100)")
+    @traced("volume")
     async def volume(self, interaction: discord.Interaction, volume: int):
         await interaction.response.defer(ephemeral=True)
-        guild_id = interaction.guild.id
         if not interaction.guild.voice_client or not interaction.guild.voice_client.is_playing():
             await interaction.followup.send("현재 재생 중인 곡이 없습니다.", ephemeral=True)
             return
         if 0 <= volume <= 100:
-            if interaction.guild.voice_client.source:
-                interaction.guild.voice_client.source.volume = volume / 100
+            source = interaction.guild.voice_client.source
+            if source:
+                if isinstance(source, OpusPassthroughSource):
+                    # FFmpeg 재시작과 버퍼링이 끝날 때까지 블로킹되므로 executor에서 교체
+                    await asyncio.get_running_loop().run_in_executor(None, source.set_volume, volume / 100)
+                else:
+                    source.volume = volume / 100
+                self.get_player(interaction.guild.id).volume = volume
                 await interaction.followup.send(f"🔊 볼륨을 {volume}%로 조정했습니다.", ephemeral=True)
             else:
                 await interaction.followup.send("볼륨을 변경할 수 없습니다.", ephemeral=True)
@@ -398,102 +2777,224 @@ class Music(commands.Cog):
             await interaction.followup.send("볼륨 값은 0에서 100 사이여야 합니다.", ephemeral=True)
     
     @app_commands.command(name="stop", description="Leave voice channel")
+    @traced("stop")
     async def stop(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        guild_id = interaction.guild.id
         if interaction.guild.voice_client:
-            embed = discord.Embed(
-                title="■ 정지",
-                description="재생을 정지하고 음성 채널을 나갔어요.",
-                color=discord.Color.dark_gray()
-            )
-            if guild_id in self.nowplaying_message:
-                try:
-                    await self.nowplaying_message[guild_id].edit(content="", embed=embed)
-                except discord.NotFound:
-                    pass
             await interaction.followup.send(f"🚫 봇이 `{interaction.guild.voice_client.channel}` 채널에서 퇴장했습니다.", ephemeral=True)
-            await self.reset_state(guild_id)
-            await interaction.guild.voice_client.disconnect()
+            await self.shutdown_player(interaction.guild, "재생을 정지하고 음성 채널을 나갔어요.")
         else:
             await interaction.followup.send("❌ 봇이 현재 음성 채널에 연결되어 있지 않습니다.", ephemeral=True)
     
     @app_commands.command(name="pause", description="Pause current song")
+    @traced("pause")
     async def pause(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         if interaction.guild.voice_client.is_playing():
             interaction.guild.voice_client.pause()
+            if isinstance(interaction.guild.voice_client.source, NodeAudioSource):
+                interaction.guild.voice_client.source.pause()
             await interaction.followup.send("음악이 일시 정지되었습니다.", ephemeral=True)
         else:
             await interaction.followup.send("재생 중인 음악이 없습니다.", ephemeral=True)
     
     @app_commands.command(name="resume", description="Resume paused song")
+    @traced("resume")
     async def resume(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
         if interaction.guild.voice_client.is_paused():
+            if isinstance(interaction.guild.voice_client.source, NodeAudioSource):
+                interaction.guild.voice_client.source.resume()
             interaction.guild.voice_client.resume()
+            # 오래 일시정지된 동안 다음 곡 URL이 만료됐을 수 있으므로 다시 확인
+            player = self.players.get(interaction.guild.id)
+            if player is not None:
+                self.schedule_refresh(player)
             await interaction.followup.send("음악이 다시 재생됩니다.", ephemeral=True)
         else:
             await interaction.followup.send("재생할 음악이 없습니다.", ephemeral=True)
     
+    @app_commands.command(name="seek", description="Seek to a position in current song")
+    @app_commands.describe(seconds="Position in seconds")
+    @traced("seek")
+    async def seek(self, interaction: discord.Interaction, seconds: int):
+        await interaction.response.defer(ephemeral=True)
+        voice_client = interaction.guild.voice_client
+        source = voice_client.source if voice_client else None
+        if not isinstance(source, NodeAudioSource):
+            await interaction.followup.send("❌ 오디오 노드로 재생 중인 곡에서만 이동할 수 있습니다.", ephemeral=True)
+            return
+        if not 0 <= seconds < source.track.duration:
+            await interaction.followup.send("❌ 곡 길이 안의 위치를 입력하세요.", ephemeral=True)
+            return
+        source.seek(seconds)
+        await interaction.followup.send(f"⏩ `{datetime.timedelta(seconds=seconds)}` 위치로 이동했습니다.", ephemeral=True)
+
     @app_commands.command(name="playlist", description="Show current queue")
+    @traced("playlist")
     async def playlist(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True)
-        guild_id = interaction.guild.id
-        current_title = self.current[guild_id].title if self.current.get(guild_id) else "없음"
-        if not self.queue[guild_id].empty():
-            queue_titles = "\n".join([f"{idx+1}. {track.title}" for idx, track in enumerate(list(self.queue[guild_id]._queue))])
-        else:
-            queue_titles = "대기열이 비어 있습니다."
-        message = f"**현재 재생 중:** {current_title}\n**플레이리스트:**\n{queue_titles}"
-        await interaction.followup.send(message, ephemeral=True)
+        player = self.players.get(interaction.guild.id)
+        if player is None or not player.queue:
+            current_title = player.current.title if player and player.current else "없음"
+            await interaction.followup.send(f"**현재 재생 중:** {current_title}\n**플레이리스트:**\n대기열이 비어 있습니다.",
+                                            ephemeral=True)
+            return
+        view = QueuePageView(self, player.guild_id)
+        view.sync_buttons(player, 0)
+        await interaction.followup.send(self.playlist_text(player, 0), view=view, ephemeral=True)
+
+    def playlist_text(self, player, page):
+        current_title = player.current.title if player.current else "없음"
+        guild_queue = player.queue
+        queue_titles = player.render_queue_page(page)
+        queue_titles += f"\n\n총 {len(guild_queue)}곡 · ⏳ `{datetime.timedelta(seconds=guild_queue.total_duration)}`"
+        if player.page_count > 1:
+            queue_titles += f" · 📄 {page + 1}/{player.page_count}"
+        return f"**현재 재생 중:** {current_title}\n**플레이리스트:**\n{queue_titles}"
     
     @app_commands.command(name="remove", description="Remove a song from queue")
     @app_commands.describe(index="Index of the song to remove")
+    @traced("remove")
     async def remove(self, interaction: discord.Interaction, index: int):
         await interaction.response.defer(ephemeral=True)
-        guild_id = interaction.guild.id
-        if self.queue[guild_id].empty():
+        player = self.players.get(interaction.guild.id)
+        if not player or not player.queue:
             await interaction.followup.send("📭 대기열이 비어 있습니다.", ephemeral=True)
             return
-        temp_queue = list(self.queue[guild_id]._queue)
-        if 0 < index <= len(temp_queue):
-            removed = temp_queue.pop(index - 1)
+        if 0 < index <= len(player.queue):
+            removed = player.queue.remove(index - 1)
             await interaction.followup.send(f"🗑️ 삭제: {removed.title}", ephemeral=True)
-            self.queue[guild_id] = asyncio.Queue()
-            for item in temp_queue:
-                await self.queue[guild_id].put(item)
         else:
             await interaction.followup.send("❌ 유효한 번호를 입력하세요.", ephemeral=True)
     
+    @app_commands.command(name="move", description="Move a song to another position in queue")
+    @app_commands.describe(index="Index of the song to move", position="New position in queue")
+    @traced("move")
+    async def move(self, interaction: discord.Interaction, index: int, position: int):
+        await interaction.response.defer(ephemeral=True)
+        player = self.players.get(interaction.guild.id)
+        if not player or not player.queue:
+            await interaction.followup.send("📭 대기열이 비어 있습니다.", ephemeral=True)
+            return
+        size = len(player.queue)
+        if 0 < index <= size and 0 < position <= size:
+            moved = player.queue.move(index - 1, position - 1)
+            await interaction.followup.send(f"↕️ 이동: {moved.title} → {position}번", ephemeral=True)
+        else:
+            await interaction.followup.send("❌ 유효한 번호를 입력하세요.", ephemeral=True)
+    
+    @app_commands.command(name="shuffle", description="Shuffle the queue")
+    @traced("shuffle")
+    async def shuffle(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        player = self.players.get(interaction.guild.id)
+        if not player or not player.queue:
+            await interaction.followup.send("📭 대기열이 비어 있습니다.", ephemeral=True)
+            return
+        player.queue.shuffle()
+        await interaction.followup.send(f"🔀 대기열 {len(player.queue)}곡을 섞었습니다.", ephemeral=True)
+    
     @app_commands.command(name="autoplay", description="자동재생기능 'on' 또는 'off'")
     @app_commands.describe(state="Enable or disable autoplay (on/off)")
+    @traced("autoplay")
     async def autoplay(self, interaction: discord.Interaction, state: str):
-        guild_id = interaction.guild.id
+        player = self.get_player(interaction.guild.id)
         if state.lower() == "on":
-            self.autoplay[guild_id] = True
+            player.autoplay = True
             await interaction.response.send_message("✅ 추천곡 자동 재생이 **활성화**되었습니다.", ephemeral=True)
         elif state.lower() == "off":
-            self.autoplay[guild_id] = False
+            player.autoplay = False
             await interaction.response.send_message("❌ 추천곡 자동 재생이 **비활성화**되었습니다.", ephemeral=True)
         else:
             await interaction.response.send_message("⚠️ 사용법: `/autoplay on` 또는 `/autoplay off`", ephemeral=True)
 
-@bot.event
-async def on_ready():
-    print(f"{bot.user} 봇 실행!! (ID: {bot.user.id})")
-    print("------")
-    activity = discord.Activity(type=discord.ActivityType.playing, name="서재원과")
-    await bot.change_presence(status=discord.Status.online, activity=activity)
-    try:
-        await bot.tree.sync()
-        print("✅ 모든 서버에서 슬래시 명령어 동기화 완료!")
-    except Exception as e:
-        print(f"❌ 슬래시 명령어 동기화 실패: {e}")
+def create_bot(*, shard_ids=None, shard_count=None):
+    """
+    AutoShardedBot을 생성합니다. shard_ids를 지정하면 이 프로세스는 해당 샤드만 연결하고,
+    지정하지 않으면 한 프로세스가 모든 샤드를 맡습니다.
+    """
+    bot = commands.AutoShardedBot(command_prefix="/", description="봇 사용설명서", intents=intents,
+                                  shard_ids=shard_ids, shard_count=shard_count)
+
+    @bot.event
+    async def on_ready():
+        log.info("%s 봇 실행!! (ID: %s, 샤드: %s/%s)", bot.user, bot.user.id,
+                 sorted(bot.shards), bot.shard_count)
+        activity = discord.Activity(type=discord.ActivityType.playing, name="서재원과")
+        await bot.change_presence(status=discord.Status.online, activity=activity)
+        if CLUSTER_ID != 0:
+            return  # 글로벌 명령어 동기화는 첫 번째 클러스터만
+        try:
+            await bot.tree.sync()
+            log.info("모든 서버에서 슬래시 명령어 동기화 완료!")
+        except Exception as e:
+            log.error("슬래시 명령어 동기화 실패: %s", e)
 
-async def main():
+    return bot
+
+async def main(shard_ids=None, shard_count=SHARD_COUNT):
+    setup_logging()
+    bot = create_bot(shard_ids=shard_ids, shard_count=shard_count)
     async with bot:
         await bot.add_cog(Music(bot))
-        await bot.start(os.getenv("discord_token"))
+        try:
+            await bot.start(os.getenv("discord_token"))
+        finally:
+            await bot.remove_cog("Music")  # 종료 전에 남은 대기열 변경 사항을 저널에 기록
+
+def run_cluster(shard_ids, shard_count):
+    """클러스터 워커 프로세스 진입점"""
+    asyncio.run(main(shard_ids=shard_ids, shard_count=shard_count))
+
+async def fetch_shard_count():
+    """Discord가 권장하는 샤드 수를 조회"""
+    client = discord.Client(intents=intents)
+    try:
+        await client.login(os.getenv("discord_token"))
+        return (await client.http.get_bot_gateway())[0]
+    finally:
+        await client.close()
+
+def launch_cluster():
+    """
+    샤드를 cluster_count개 워커 프로세스에 나눠 실행하고, 비정상 종료된 워커는 다시 시작합니다.
+    guild의 샤드는 (guild_id >> 22) % shard_count로 정해지므로 길드 상태는 항상 한 프로세스에만 존재합니다.
+    """
+    setup_logging()
+    shard_count = SHARD_COUNT or asyncio.run(fetch_shard_count())
+    cluster_count = min(CLUSTER_COUNT, shard_count)
+    context = multiprocessing.get_context("spawn")
+    clusters = {}
+
+    def start(cluster_id):
+        shard_ids = list(range(cluster_id, shard_count, cluster_count))
+        os.environ["cluster_id"] = str(cluster_id)  # spawn된 프로세스가 시작할 때 환경 변수를 복사
+        process = context.Process(target=run_cluster, args=(shard_ids, shard_count), name=f"cluster-{cluster_id}")
+        process.start()
+        clusters[cluster_id] = process
+        log.info("클러스터 %d 시작 (pid %d, 샤드 %s)", cluster_id, process.pid, shard_ids)
+        return shard_ids
+
+    for cluster_id in range(cluster_count):
+        shard_ids = start(cluster_id)
+        time.sleep(CLUSTER_START_DELAY * len(shard_ids))
+    try:
+        while True:
+            time.sleep(CLUSTER_START_DELAY)
+            for cluster_id, process in list(clusters.items()):
+                if process.exitcode is not None:
+                    log.warning("클러스터 %d 종료됨 (exit code %s), 다시 시작", cluster_id, process.exitcode)
+                    start(cluster_id)
+    except KeyboardInterrupt:
+        # 같은 프로세스 그룹의 워커도 SIGINT를 받아 저널을 기록하고 종료함
+        for process in clusters.values():
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
 
-asyncio.run(main())
+if __name__ == "__main__":
+    if CLUSTER_COUNT > 1:
+        launch_cluster()
+    else:
+        asyncio.run(main())